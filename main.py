@@ -1,4 +1,5 @@
 import threading
+import queue
 import webbrowser
 import tkinter as tk
 from tkinter import filedialog
@@ -12,35 +13,78 @@ import cv2
 import onnxruntime
 import warnings
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import hashlib
+from collections import OrderedDict, deque
+import bisect
+import csv
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 warnings.filterwarnings("ignore")
 
-def initialize_session(model_path):
-    ''' 初始化ONNX Runtime会话 '''
-    # 颜色定义
-    palette = np.array([[255, 128, 0], [255, 153, 51], [255, 178, 102],
-                        [230, 230, 0], [255, 153, 255], [153, 204, 255],
-                        [255, 102, 255], [255, 51, 255], [102, 178, 255],
-                        [51, 153, 255], [255, 153, 153], [255, 102, 102],
-                        [255, 51, 51], [153, 255, 153], [102, 255, 102],
-                        [51, 255, 51], [0, 255, 0], [0, 0, 255], [255, 0, 0],
-                        [255, 255, 255]])
-
-    # 骨架连接定义 (COCO格式)
-    skeleton = [[16, 14], [14, 12], [17, 15], [15, 13], [12, 13], [6, 12],
-                [7, 13], [6, 7], [6, 8], [7, 9], [8, 10], [9, 11], [2, 3],
-                [1, 2], [1, 3], [2, 4], [3, 5], [4, 6], [5, 7]]
-
-    pose_limb_color = palette[[9, 9, 9, 9, 7, 7, 7, 0, 0, 0, 0, 0, 16, 16, 16, 16, 16, 16, 16]]
-    pose_kpt_color = palette[[16, 16, 16, 16, 16, 0, 0, 0, 0, 0, 0, 9, 9, 9, 9, 9, 9]]
-
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+# 骨骼模型输入尺寸、letterbox填充值和归一化系数
+SKELETON_INPUT_SIZE = (640, 640)
+SKELETON_PAD_VALUE = 114
+SKELETON_INPUT_SCALE = np.float32(0.00392156862745098)
+SKELETON_ROI_INPUT_SIZE = (320, 320)  # ROI跟踪时的输入尺寸，仅用于支持动态输入尺寸的模型
+
+# 颜色定义
+SKELETON_PALETTE = np.array([[255, 128, 0], [255, 153, 51], [255, 178, 102],
+                             [230, 230, 0], [255, 153, 255], [153, 204, 255],
+                             [255, 102, 255], [255, 51, 255], [102, 178, 255],
+                             [51, 153, 255], [255, 153, 153], [255, 102, 102],
+                             [255, 51, 51], [153, 255, 153], [102, 255, 102],
+                             [51, 255, 51], [0, 255, 0], [0, 0, 255], [255, 0, 0],
+                             [255, 255, 255]])
+
+# 骨架连接定义 (COCO格式)
+SKELETON_LIMBS = [[16, 14], [14, 12], [17, 15], [15, 13], [12, 13], [6, 12],
+                  [7, 13], [6, 7], [6, 8], [7, 9], [8, 10], [9, 11], [2, 3],
+                  [1, 2], [1, 3], [2, 4], [3, 5], [4, 6], [5, 7]]
+
+SKELETON_LIMB_COLORS = SKELETON_PALETTE[[9, 9, 9, 9, 7, 7, 7, 0, 0, 0, 0, 0, 16, 16, 16, 16, 16, 16, 16]]
+SKELETON_KPT_COLORS = SKELETON_PALETTE[[16, 16, 16, 16, 16, 0, 0, 0, 0, 0, 0, 9, 9, 9, 9, 9, 9]]
+
+def group_by_color(colors, items):
+    ''' 把绘制项按颜色分组，返回[(颜色, 该颜色的绘制项数组)] '''
+    groups = OrderedDict()
+    for color, item in zip(colors.tolist(), items):
+        groups.setdefault(tuple(color), []).append(item)
+    return [(color, np.array(group)) for color, group in groups.items()]
+
+# 按颜色分组的关节序号和骨骼端点序号(从0开始)，绘制时每种颜色只调用一次
+SKELETON_KPT_GROUPS = group_by_color(SKELETON_KPT_COLORS, range(len(SKELETON_KPT_COLORS)))
+SKELETON_LIMB_GROUPS = group_by_color(SKELETON_LIMB_COLORS, [(a - 1, b - 1) for a, b in SKELETON_LIMBS])
+
+# 推理设置中可选的图优化级别
+SESSION_OPTIMIZATION_LEVELS = OrderedDict([
+    ("disable", onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL),
+    ("basic", onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC),
+    ("extended", onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED),
+    ("all", onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL),
+])
+
+def initialize_session(model_path, intra_threads=None, inter_threads=None, parallel=False,
+                       optimization_level="extended"):
+    ''' 初始化ONNX Runtime会话；线程数为None或0时由ONNX Runtime决定，parallel为True时算子间并行执行 '''
     if not os.path.exists(model_path):
         print(f"模型文件不存在: {model_path}")
         return None
 
     try:
         session_options = onnxruntime.SessionOptions()
-        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        session_options.graph_optimization_level = SESSION_OPTIMIZATION_LEVELS[optimization_level]
+        if intra_threads:
+            session_options.intra_op_num_threads = intra_threads
+        if inter_threads:
+            session_options.inter_op_num_threads = inter_threads
+        if parallel:
+            session_options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
         ort_session = onnxruntime.InferenceSession(model_path,
                                                    session_options=session_options,
                                                    providers=['CPUExecutionProvider'])
@@ -50,55 +94,135 @@ def initialize_session(model_path):
         print(f"加载模型失败: {e}")
         return None
 
-def show_skeleton_frame(ort_session, img, conf_threshold=0.1):
-    ''' 处理单帧图像 '''
-    # 颜色定义 (重复定义以便函数独立)
-    palette = np.array([[255, 128, 0], [255, 153, 51], [255, 178, 102],
-                        [230, 230, 0], [255, 153, 255], [153, 204, 255],
-                        [255, 102, 255], [255, 51, 255], [102, 178, 255],
-                        [51, 153, 255], [255, 153, 153], [255, 102, 102],
-                        [255, 51, 51], [153, 255, 153], [102, 255, 102],
-                        [51, 255, 51], [0, 255, 0], [0, 0, 255], [255, 0, 0],
-                        [255, 255, 255]])
-
-    # 骨架连接定义 (COCO格式)
-    skeleton = [[16, 14], [14, 12], [17, 15], [15, 13], [12, 13], [6, 12],
-                [7, 13], [6, 7], [6, 8], [7, 9], [8, 10], [9, 11], [2, 3],
-                [1, 2], [1, 3], [2, 4], [3, 5], [4, 6], [5, 7]]
-
-    pose_limb_color = palette[[9, 9, 9, 9, 7, 7, 7, 0, 0, 0, 0, 0, 16, 16, 16, 16, 16, 16, 16]]
-    pose_kpt_color = palette[[16, 16, 16, 16, 16, 0, 0, 0, 0, 0, 0, 9, 9, 9, 9, 9, 9]]
-
-    # 图像预处理 (letterbox功能)
-    shape = img.shape[:2]
-    new_shape = (640, 640)
-    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
-    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
-    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
-    dw /= 2
-    dh /= 2
-    if shape[::-1] != new_unpad:
-        image1 = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
-    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
-    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
-    image1 = cv2.copyMakeBorder(image1, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
-
-    # 图像归一化 (read_img功能)
-    img_mean = 0.0
-    img_scale = 0.00392156862745098
-    input = (image1 - img_mean) * img_scale
-    input = np.asarray(input, dtype=np.float32)
-    input = np.expand_dims(input, 0)
-    input = input.transpose(0, 3, 1, 2)
+def model_batch_size(ort_session):
+    ''' 模型输入的batch维，动态batch时返回None '''
+    batch = ort_session.get_inputs()[0].shape[0]
+    return batch if isinstance(batch, int) else None
+
+def model_input_size(ort_session):
+    ''' 模型输入的(高, 宽)，动态尺寸时返回默认的640x640 '''
+    shape = ort_session.get_inputs()[0].shape
+    if len(shape) == 4 and isinstance(shape[2], int) and isinstance(shape[3], int):
+        return shape[2], shape[3]
+    return SKELETON_INPUT_SIZE
+
+class SkeletonSession:
+    ''' 骨骼模型推理封装：缓存输入输出信息，用IOBinding把输出写入按输入形状预分配的CPU缓冲区 '''
+    def __init__(self, ort_session):
+        self.session = ort_session
+        self.input_name = ort_session.get_inputs()[0].name
+        self.output_name = ort_session.get_outputs()[0].name
+        self.batch_size = model_batch_size(ort_session)  # None表示动态batch
+        self.input_size = model_input_size(ort_session)
+        shape = ort_session.get_inputs()[0].shape
+        self.dynamic_size = len(shape) == 4 and not (isinstance(shape[2], int) and isinstance(shape[3], int))
+        self.binding = ort_session.io_binding()
+        self.outputs = {}  # 输入形状 -> 预分配的输出缓冲区，None表示输出形状不固定
+        self.lock = threading.Lock()
+
+    def get_inputs(self):
+        return self.session.get_inputs()
+
+    def run(self, tensor):
+        ''' 推理并返回第一个输出；使用预分配缓冲区时返回的数组会在下次推理时被覆盖 '''
+        with self.lock:
+            self.binding.bind_cpu_input(self.input_name, tensor)
+            output = self.outputs.get(tensor.shape, False)
+            if output is not None and output is not False:
+                self.binding.bind_output(self.output_name, 'cpu', 0, output.dtype, list(output.shape),
+                                         output.ctypes.data)
+                try:
+                    self.session.run_with_iobinding(self.binding)
+                    return output
+                except Exception:
+                    # 输出形状随输入内容变化(如模型内含NMS)，该输入形状改由ONNX Runtime分配输出
+                    self.outputs[tensor.shape] = output = None
+            self.binding.bind_output(self.output_name, 'cpu')
+            self.session.run_with_iobinding(self.binding)
+            result = self.binding.copy_outputs_to_cpu()[0]
+            if output is False:
+                # 首次遇到该输入形状，按实际输出形状分配缓冲区
+                self.outputs[tensor.shape] = np.empty_like(result)
+            return result
+
+    def warmup(self, runs=3):
+        ''' 用填充值输入预跑几次，让内存分配和内核选择在首帧推理之前完成 '''
+        tensor = np.full((self.batch_size or 1, 3) + tuple(self.input_size),
+                         SKELETON_PAD_VALUE * SKELETON_INPUT_SCALE, dtype=np.float32)
+        for _ in range(runs):
+            self.run(tensor)
+
+def model_file_hash(model_path):
+    ''' 模型文件内容的sha1，用于区分不同模型的关键点缓存 '''
+    sha1 = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class LetterboxPreprocessor:
+    ''' 骨骼模型输入预处理：按源分辨率预分配1x3x640x640输入张量，逐帧原地写入letterbox和归一化结果；
+    tensor可传入batch输入张量中的一行，预处理结果直接写入该行 '''
+    def __init__(self, input_size=SKELETON_INPUT_SIZE, tensor=None):
+        self.input_size = input_size  # (高, 宽)
+        self.shape = None  # 当前缓冲区对应的源图像形状
+        self.tensor = tensor
+        self.resized = None  # 缩放结果缓冲区，源图像无需缩放时为None
+        self.channels = None  # 输入张量中有效图像区域的逐通道视图
+        self.gain = 1.0
+        self.pad = (0.0, 0.0)
+
+    def configure(self, shape):
+        ''' 按源图像形状计算缩放参数并分配缓冲区，填充区域只在这里写一次 '''
+        self.shape = shape
+        height, width = self.input_size
+        r = min(height / shape[0], width / shape[1])
+        new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+        dw, dh = (width - new_unpad[0]) / 2, (height - new_unpad[1]) / 2
+        top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+        self.resized = None
+        if shape[1::-1] != new_unpad:
+            self.resized = np.empty((new_unpad[1], new_unpad[0], 3), dtype=np.uint8)
+        if self.tensor is None:
+            self.tensor = np.empty((1, 3, height, width), dtype=np.float32)
+        self.tensor.fill(SKELETON_PAD_VALUE * SKELETON_INPUT_SCALE)
+        self.channels = [self.tensor[0, c, top:top + new_unpad[1], left:left + new_unpad[0]] for c in range(3)]
+        # 检测结果从输入张量坐标还原到原图坐标用的缩放和偏移
+        self.gain = min(height / shape[0], width / shape[1])
+        self.pad = (width - shape[1] * self.gain) / 2, (height - shape[0] * self.gain) / 2
+
+    def __call__(self, img):
+        ''' 返回写入了img的输入张量，下次调用时会被覆盖 '''
+        if img.shape != self.shape:
+            self.configure(img.shape)
+        source = img
+        if self.resized is not None:
+            cv2.resize(img, (self.resized.shape[1], self.resized.shape[0]), dst=self.resized,
+                       interpolation=cv2.INTER_LINEAR)
+            source = self.resized
+        for c, channel in enumerate(self.channels):
+            np.multiply(source[:, :, c], SKELETON_INPUT_SCALE, out=channel)
+        return self.tensor
+
+def detect_skeleton(ort_session, img, conf_threshold=0.1, preprocessor=None):
+    ''' 单帧骨骼推理，返回原图坐标下的(检测框, 置信度, 关键点)，未检测到目标时返回None；
+    连续处理同分辨率的帧时传入同一个preprocessor以复用输入缓冲区 '''
+    if not isinstance(ort_session, SkeletonSession):
+        ort_session = SkeletonSession(ort_session)
+    if preprocessor is None:
+        preprocessor = LetterboxPreprocessor(ort_session.input_size)
+    input = preprocessor(img)
 
     # 模型推理
-    input_name = ort_session.get_inputs()[0].name
-    output = ort_session.run([], {input_name: input})[0]
+    output = ort_session.run(input)
+    return postprocess_skeleton(output, img.shape, preprocessor, conf_threshold)
 
+def postprocess_skeleton(output, img0_shape, preprocessor, conf_threshold):
+    ''' 把单张图像的模型输出还原为原图坐标下的(检测框, 置信度, 关键点)，未检测到目标时返回None '''
     # 置信度过滤
     output = output[output[..., 4] > conf_threshold]
     if len(output) == 0:
-        return img, None  # 没有检测到任何目标，返回原图和空关键点
+        return None  # 没有检测到任何目标
 
     # 坐标转换 (xyxy2xywh功能)
     det_box = np.copy(output)
@@ -106,17 +230,14 @@ def show_skeleton_frame(ort_session, img, conf_threshold=0.1):
     det_box[:, 3] = output[:, 3] - output[:, 1]  # h
 
     # 坐标缩放 (scale_boxes功能)
-    img1_shape = image1.shape
-    img0_shape = img.shape
-    gain = min(img1_shape[0] / img0_shape[0], img1_shape[1] / img0_shape[1])
-    pad = (img1_shape[1] - img0_shape[1] * gain) / 2, (img1_shape[0] - img0_shape[0] * gain) / 2
-    det_box[:, 0] -= pad[0]
-    det_box[:, 1] -= pad[1]
+    gain = preprocessor.gain
+    pad = np.asarray(preprocessor.pad, dtype=np.float32)
+    det_box[:, :2] -= pad
     det_box[:, :4] /= gain
-    num_kpts = det_box.shape[1] // 3
-    for kid in range(2, num_kpts):
-        det_box[:, kid * 3] = (det_box[:, kid * 3] - pad[0]) / gain
-        det_box[:, kid * 3 + 1] = (det_box[:, kid * 3 + 1] - pad[1]) / gain
+    # 关键点按(N, 关键点数, 3)一次性换算，写回det_box
+    kpts = det_box[:, 6:].reshape(len(det_box), -1, 3)
+    kpts[..., :2] = (kpts[..., :2] - pad) / gain
+    det_box[:, 6:] = kpts.reshape(len(det_box), -1)
 
     # 裁剪框 (clip_boxes功能)
     top_left_x = det_box[:, 0].clip(0, img0_shape[1])
@@ -131,178 +252,2260 @@ def show_skeleton_frame(ort_session, img, conf_threshold=0.1):
     # 提取检测框和关键点
     det_bboxes, det_scores, det_labels, kpts = det_box[:, 0:4], det_box[:, 4], det_box[:, 5], det_box[:, 6:]
 
-    # 绘制骨骼关键点 (plot_skeleton_kpts功能)
-    for idx in range(len(det_bboxes)):
-        kpt = kpts[idx]
-        steps = 3
-        num_kpts = len(kpt) // steps
-        for kid in range(num_kpts):
-            r, g, b = pose_kpt_color[kid]
-            x_coord, y_coord = kpt[steps * kid], kpt[steps * kid + 1]
-            conf = kpt[steps * kid + 2]
-            if conf > 0.5:
-                cv2.circle(img, (int(x_coord), int(y_coord)), 3, (int(r), int(g), int(b)), -1)
-        for sk_id, sk in enumerate(skeleton):
-            r, g, b = pose_limb_color[sk_id]
-            pos1 = (int(kpt[(sk[0] - 1) * steps]), int(kpt[(sk[0] - 1) * steps + 1]))
-            pos2 = (int(kpt[(sk[1] - 1) * steps]), int(kpt[(sk[1] - 1) * steps + 1]))
-            conf1 = kpt[(sk[0] - 1) * steps + 2]
-            conf2 = kpt[(sk[1] - 1) * steps + 2]
-            if conf1 > 0.5 and conf2 > 0.5:
-                cv2.line(img, pos1, pos2, (int(r), int(g), int(b)), thickness=2)
+    return det_bboxes, det_scores, kpts
+
+class SkeletonBatcher:
+    ''' 把多帧预处理结果写入同一个batch输入张量，凑满batch_size帧再做一次session.run；
+    模型的batch维固定时按模型的batch大小推理 '''
+    def __init__(self, ort_session, batch_size=8, conf_threshold=0.1):
+        if not isinstance(ort_session, SkeletonSession):
+            ort_session = SkeletonSession(ort_session)
+        self.ort_session = ort_session
+        self.conf_threshold = conf_threshold
+        self.fixed_batch = ort_session.batch_size
+        self.batch_size = self.fixed_batch or max(1, batch_size)
+        input_size = ort_session.input_size
+        self.tensor = np.empty((self.batch_size, 3) + tuple(input_size), dtype=np.float32)
+        self.preprocessors = [LetterboxPreprocessor(input_size, self.tensor[i:i + 1])
+                              for i in range(self.batch_size)]
+        self.keys = []  # 已写入batch的帧的(键, 图像形状)
+
+    def add(self, key, img):
+        ''' 加入一帧，batch凑满时推理并返回[(键, 检测结果)]，否则返回空列表 '''
+        self.preprocessors[len(self.keys)](img)
+        self.keys.append((key, img.shape))
+        if len(self.keys) == self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        ''' 推理batch中剩余的帧，返回[(键, 检测结果)]，检测结果为None表示未检测到目标 '''
+        count = len(self.keys)
+        if count == 0:
+            return []
+        # 固定batch的模型只能整批推理，多出的行是上一批的残留数据，结果直接丢弃
+        tensor = self.tensor if self.fixed_batch else self.tensor[:count]
+        output = self.ort_session.run(tensor)
+        results = [(key, postprocess_skeleton(output[i:i + 1], shape, self.preprocessors[i], self.conf_threshold))
+                   for i, (key, shape) in enumerate(self.keys)]
+        self.keys = []
+        return results
+
+def draw_skeleton_kpts(img, kpts, scale=1.0):
+    ''' 在图像上绘制骨骼关键点，scale为关键点坐标到img的缩放比例；同色的关节和骨骼各用一次polylines绘制 '''
+    if len(kpts) == 0:
+        return
+    kpts = np.asarray(kpts).reshape(len(kpts), -1, 3)
+    points = (kpts[..., :2] * scale).astype(np.int32)
+    visible = kpts[..., 2] > 0.5
+
+    # 关节：长度为0、线宽为6的线段与半径3的实心圆像素完全一致
+    for color, kids in SKELETON_KPT_GROUPS:
+        kids = kids[kids < kpts.shape[1]]
+        joints = points[:, kids][visible[:, kids]]
+        if len(joints):
+            cv2.polylines(img, list(np.stack([joints, joints], axis=1)), False, color, thickness=6)
+
+    # 骨骼：两端关节都可见时连线
+    for color, limbs in SKELETON_LIMB_GROUPS:
+        shown = visible[:, limbs[:, 0]] & visible[:, limbs[:, 1]]
+        segments = np.stack([points[:, limbs[:, 0]][shown], points[:, limbs[:, 1]][shown]], axis=1)
+        if len(segments):
+            cv2.polylines(img, list(segments), False, color, thickness=2)
 
+def show_skeleton_frame(ort_session, img, conf_threshold=0.1):
+    ''' 处理单帧图像 '''
+    detections = detect_skeleton(ort_session, img, conf_threshold)
+    if detections is None:
+        return img, None  # 没有检测到任何目标，返回原图和空关键点
+    kpts = detections[2]
+    draw_skeleton_kpts(img, kpts)
     return img, kpts[0]  # 返回处理后的图像和第一个人的关键点
 
-def export_cropped_video(video_dir, txt_dir, output_dir, progress_var, status_label, top_window, crop):
-    """处理视频（进度条基于所有TXT文件的总记录数）"""
-    # 确保输出目录存在
-    os.makedirs(output_dir, exist_ok=True)
+class SkeletonTracker:
+    ''' ROI跟踪推理：在上一帧检测框(或用户框选区域)外扩后的区域内推理，区域内最高置信度低于
+    min_score或没有目标时回到全帧检测；模型支持动态输入尺寸时区域推理使用更小的输入 '''
+    def __init__(self, padding=0.5, min_score=0.5):
+        self.padding = padding  # 区域向四周外扩检测框边长的比例
+        self.min_score = min_score
+        self.video_path = None
+        self.roi = None  # 当前跟踪区域(x1, y1, x2, y2)，推理帧坐标
+        self.full_preprocessor = None
+        self.crop_preprocessor = None
+
+    def reset(self, video_path=None):
+        self.video_path = video_path
+        self.roi = None
+
+    def observe(self, detections):
+        ''' 用检测结果更新跟踪区域，置信度不足时清除 '''
+        if detections is None or len(detections[1]) == 0 or detections[1].max() < self.min_score:
+            self.roi = None
+        else:
+            boxes = detections[0]
+            self.roi = (boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max())
+
+    def expand(self, roi, shape):
+        ''' 外扩跟踪区域；边长取64的倍数并整体平移到画面内，使区域尺寸少变化，预处理缓冲区得以复用 '''
+        height, width = shape[:2]
+        x1, y1, x2, y2 = roi
+        side = int(np.ceil(max(x2 - x1, y2 - y1) * (1 + 2 * self.padding) / 64) * 64)
+        crop_width, crop_height = min(side, width), min(side, height)
+        left = int(min(max((x1 + x2 - crop_width) / 2, 0), width - crop_width))
+        top = int(min(max((y1 + y2 - crop_height) / 2, 0), height - crop_height))
+        return left, top, left + crop_width, top + crop_height
+
+    def detect(self, ort_session, frame, conf_threshold, hint=None):
+        ''' 返回(检测结果, 是否为全帧检测)，hint为没有跟踪目标时使用的初始区域 '''
+        if self.full_preprocessor is None or self.full_preprocessor.input_size != ort_session.input_size:
+            self.full_preprocessor = LetterboxPreprocessor(ort_session.input_size)
+            self.crop_preprocessor = LetterboxPreprocessor(
+                SKELETON_ROI_INPUT_SIZE if ort_session.dynamic_size else ort_session.input_size)
+        roi = self.roi if self.roi is not None else hint
+        if roi is not None:
+            x1, y1, x2, y2 = self.expand(roi, frame.shape)
+            detections = detect_skeleton(ort_session, frame[y1:y2, x1:x2], conf_threshold, self.crop_preprocessor)
+            if detections is not None and detections[1].max() >= self.min_score:
+                boxes, scores, kpts = detections
+                boxes[:, [0, 2]] += x1
+                boxes[:, [1, 3]] += y1
+                kpts[:, 0::3] += x1
+                kpts[:, 1::3] += y1
+                self.observe(detections)
+                return detections, False
+        detections = detect_skeleton(ort_session, frame, conf_threshold, self.full_preprocessor)
+        self.observe(detections)
+        return detections, True
+
+class SkeletonWorker:
+    ''' 骨骼推理线程：只保留最近提交的一帧，推理期间到达的旧请求直接被覆盖丢弃 '''
+    def __init__(self, keypoint_cache=None):
+        self.keypoint_cache = keypoint_cache
+        self.cond = threading.Condition()
+        self.pending = None  # 等待推理的(会话, 键, 帧, 置信度阈值, 模型哈希, 源视频宽度, 初始区域)，新提交会覆盖它
+        self.busy_key = None  # 正在推理的帧的键
+        self.result = None  # 最近一次推理结果(键, 关键点, 推理时的帧宽度)
+        self.result_id = 0  # 每产生一个新结果递增，供主线程判断是否需要重新合成
+        self.preprocessor = LetterboxPreprocessor()  # 只在推理线程中使用
+        self.tracking = False  # 是否启用ROI跟踪推理
+        self.tracker = SkeletonTracker()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, ort_session, key, frame, conf_threshold, model_hash=None, source_width=None, roi_hint=None):
+        ''' 提交一帧待推理，key为(视频路径, 帧号)，与正在推理或已有结果相同时忽略；
+        source_width为源视频宽度，从代理解码时与帧宽度不同；roi_hint为ROI跟踪的初始区域(源视频坐标) '''
+        if not isinstance(ort_session, SkeletonSession):
+            ort_session = SkeletonSession(ort_session)
+        with self.cond:
+            if key == self.busy_key or (self.result is not None and self.result[0] == key):
+                return
+            self.pending = (ort_session, key, frame, conf_threshold, model_hash, source_width or frame.shape[1],
+                            roi_hint)
+            self.cond.notify()
+
+    def latest(self):
+        ''' 返回最近一次推理结果(键, 关键点, 帧宽度)，关键点为None表示未检测到目标 '''
+        with self.cond:
+            return self.result
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                ort_session, key, frame, conf_threshold, model_hash, source_width, roi_hint = self.pending
+                self.pending = None
+                self.busy_key = key
+            kpts = None
+            try:
+                detections, width = self._detect(ort_session, key, frame, conf_threshold, model_hash,
+                                                 source_width, roi_hint)
+                if detections is not None and len(detections[2]) > 0:
+                    kpts = detections[2]
+            except Exception as e:
+                print(f"骨骼检测处理出错: {e}")
+                width = frame.shape[1]
+            with self.cond:
+                self.busy_key = None
+                self.result = (key, kpts, width)
+                self.result_id += 1
+
+    def _detect(self, ort_session, key, frame, conf_threshold, model_hash, source_width, roi_hint):
+        ''' 优先从缓存取检测结果，返回(检测结果, 坐标所在的帧宽度) '''
+        video_path, index = key
+        if self.tracking and video_path != self.tracker.video_path:
+            self.tracker.reset(video_path)
+        cache = self.keypoint_cache
+        use_cache = cache is not None and model_hash is not None and conf_threshold >= cache.CONF_FLOOR
+        detections = cache.get(video_path, model_hash, index) if use_cache else None
+        if detections is not None:
+            width = source_width
+            if self.tracking:
+                ratio = frame.shape[1] / source_width
+                self.tracker.observe((detections[0] * ratio,) + tuple(detections[1:]))
+        else:
+            width = frame.shape[1]
+            threshold = cache.CONF_FLOOR if use_cache else conf_threshold
+            full_frame = True
+            if self.tracking:
+                hint = None
+                if roi_hint is not None:
+                    hint = tuple(v * frame.shape[1] / source_width for v in roi_hint)
+                detections, full_frame = self.tracker.detect(ort_session, frame, threshold, hint)
+            else:
+                if self.preprocessor.input_size != ort_session.input_size:
+                    self.preprocessor = LetterboxPreprocessor(ort_session.input_size)
+                detections = detect_skeleton(ort_session, frame, threshold, self.preprocessor)
+            # 代理帧和ROI区域上的推理结果与原始全帧推理不同，不写入缓存
+            if use_cache and full_frame and frame.shape[1] == source_width:
+                cache.put(video_path, model_hash, index,
+                          detections if detections is not None else KeypointCache.empty())
+        if detections is None or not use_cache:
+            return detections, width
+        # 缓存中的结果按下限阈值过滤，这里再按当前阈值筛选
+        keep = detections[1] > conf_threshold
+        return tuple(array[keep] for array in detections), width
+
+class FrameCache:
+    ''' 按字节预算做LRU淘汰的解码帧缓存，键为(视频路径, 帧号) '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, video_path, index):
+        ''' 命中时返回帧并标记为最近使用，否则返回None '''
+        key = (video_path, index)
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+            return frame
+
+    def put(self, video_path, index, frame):
+        ''' 存入帧，超出预算时淘汰最久未使用的帧 '''
+        if frame.nbytes > self.max_bytes:
+            return
+        frame.flags.writeable = False  # 缓存中的帧被多处共享，禁止原地修改
+        key = (video_path, index)
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+            self.frames[key] = frame
+            self.current_bytes += frame.nbytes
+            self._evict()
+
+    def set_budget(self, max_bytes):
+        ''' 调整字节预算 '''
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.current_bytes = 0
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self.frames:
+            _, frame = self.frames.popitem(last=False)
+            self.current_bytes -= frame.nbytes
+
+class VideoIndex:
+    ''' 视频的关键帧位置与逐帧时间戳索引（按显示顺序） '''
+    def __init__(self, timestamps, keyframes):
+        self.timestamps = timestamps  # 每帧的显示时间戳(ms)，升序
+        self.keyframes = keyframes  # 关键帧的帧号，升序；为空表示未知
+        self.total_frames = len(timestamps)
+
+    def keyframe_before(self, index):
+        ''' 返回不晚于index的最近关键帧，关键帧未知时返回index本身 '''
+        if len(self.keyframes) == 0:
+            return index
+        pos = int(np.searchsorted(self.keyframes, index, side='right')) - 1
+        return int(self.keyframes[max(pos, 0)])
+
+    def keyframes_before(self, index):
+        ''' 由近到远依次返回不晚于index的关键帧 '''
+        if len(self.keyframes) == 0:
+            return [index]
+        pos = int(np.searchsorted(self.keyframes, index, side='right'))
+        return [int(k) for k in self.keyframes[:pos][::-1]]
+
+    def frame_at(self, msec):
+        ''' 根据时间戳查找对应帧号 '''
+        pos = int(np.searchsorted(self.timestamps, msec - 0.5))
+        return min(pos, self.total_frames - 1)
+
+def video_index_path(video_path):
+    ''' 索引旁路缓存文件路径 '''
+    return video_path + ".seekidx.npz"
+
+def build_video_index(video_path):
+    ''' 扫描视频建立索引，优先只解复用数据包(不解码)，不支持时退回逐帧grab '''
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    if not cap.isOpened():
+        return None
+    pts = []
+    is_key = []
+    try:
+        raw = cap.set(cv2.CAP_PROP_FORMAT, -1) and hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME')
+        while cap.grab():
+            pts.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+            is_key.append(bool(raw and cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+    finally:
+        cap.release()
+    if not pts:
+        return None
+
+    # 数据包为解码顺序，按时间戳排序得到显示顺序
+    pts = np.asarray(pts, dtype=np.float64)
+    order = np.argsort(pts, kind='stable')
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    keyframes = np.sort(ranks[np.asarray(is_key, dtype=bool)]).astype(np.int32)
+    return VideoIndex(pts[order], keyframes)
+
+def load_video_index(video_path):
+    ''' 读取旁路缓存的索引，视频大小或修改时间变化时视为失效 '''
+    index_path = video_index_path(video_path)
+    if not os.path.exists(index_path):
+        return None
+    try:
+        stat = os.stat(video_path)
+        with np.load(index_path) as data:
+            if int(data['size']) != stat.st_size or float(data['mtime']) != stat.st_mtime:
+                return None
+            return VideoIndex(data['timestamps'], data['keyframes'])
+    except Exception as e:
+        print(f"读取索引失败: {e}")
+        return None
+
+def save_video_index(video_path, index):
+    ''' 将索引写入旁路缓存文件，视频目录不可写时忽略 '''
+    index_path = video_index_path(video_path)
+    tmp_path = index_path + ".tmp"
+    try:
+        stat = os.stat(video_path)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, timestamps=index.timestamps, keyframes=index.keyframes,
+                     size=stat.st_size, mtime=stat.st_mtime)
+        os.replace(tmp_path, index_path)
+    except Exception as e:
+        print(f"保存索引失败: {e}")
+
+class VideoIndexer:
+    ''' 后台线程为首次打开的视频建立索引并缓存 '''
+    def __init__(self):
+        self.indexes = {}
+        self.queued = set()
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def get(self, video_path):
+        ''' 返回已就绪的索引，尚未建立时返回None '''
+        return self.indexes.get(video_path)
+
+    def request(self, video_path):
+        ''' 排队建立索引，重复请求会被忽略 '''
+        with self.lock:
+            if video_path in self.indexes or video_path in self.queued:
+                return
+            self.queued.add(video_path)
+        self.requests.put(video_path)
+
+    def _run(self):
+        while True:
+            video_path = self.requests.get()
+            index = load_video_index(video_path)
+            if index is None:
+                try:
+                    index = build_video_index(video_path)
+                except Exception as e:
+                    print(f"建立索引失败: {e}")
+                if index is not None:
+                    save_video_index(video_path, index)
+            with self.lock:
+                self.queued.discard(video_path)
+                if index is not None:
+                    self.indexes[video_path] = index
+
+class VideoReader:
+    ''' 长期持有的视频解码会话，每个视频只打开一次并缓存元数据 '''
+    def __init__(self, video_path, seek_threshold=64, frame_cache=None, backfill=30):
+        self.video_path = video_path
+        self.seek_threshold = seek_threshold  # 前跳超过该帧数(约一个GOP)时改用seek
+        self.frame_cache = frame_cache
+        self.backfill = backfill  # 后退未命中缓存时，向前多解码并缓存的帧数
+        self.cap = cv2.VideoCapture(video_path)
+        self.opened = self.cap.isOpened()
+        self.width = 0
+        self.height = 0
+        self.fps = 0.0
+        self.total_frames = 0
+        self.next_index = -1  # 下一次read()顺序返回的帧号，-1表示位置未知
+        self.index = None  # 关键帧/时间戳索引，建立完成后由set_index设置
+        if self.opened:
+            self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+            self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.next_index = 0
+
+    def set_index(self, index):
+        ''' 使用索引做精确seek，总帧数以索引为准 '''
+        self.index = index
+        self.total_frames = index.total_frames
+
+    def read(self, index):
+        ''' 读取指定帧，小幅前跳用grab()跳过中间帧，大幅跳转或后退才执行seek '''
+        if not self.opened:
+            return False, None
+        if self.frame_cache is not None:
+            frame = self.frame_cache.get(self.video_path, index)
+            if frame is not None:
+                return True, frame
+        gap = index - self.next_index
+        if self.next_index < 0 or gap < 0 or gap > self.seek_threshold:
+            if self.frame_cache is not None and gap < 0 and index > 0:
+                # 后退时一次性解码前面一段并缓存，使连续后退直接命中
+                return self._read_backfill(index)
+            grabbed = self._seek_grab(index)
+        else:
+            # 倍速播放时中间帧只grab，不做retrieve和颜色转换
+            grabbed = True
+            for _ in range(gap + 1):
+                if not self.cap.grab():
+                    grabbed = False
+                    break
+        ret, frame = self.cap.retrieve() if grabbed else (False, None)
+        self.next_index = index + 1 if ret else -1
+        if ret and self.frame_cache is not None:
+            self.frame_cache.put(self.video_path, index, frame)
+        return ret, frame
+
+    def _seek_grab(self, index):
+        ''' 定位并grab第index帧；有索引时从最近关键帧向前解码，并用时间戳校验落点 '''
+        if self.index is None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            return self.cap.grab()
+        # 部分容器的seek并不精确，落点越过目标时退到更早的关键帧
+        for key in self.index.keyframes_before(index)[:3] + [0]:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, key)
+            if not self.cap.grab():
+                return False
+            pos = self.index.frame_at(self.cap.get(cv2.CAP_PROP_POS_MSEC))
+            if pos <= index:
+                break
+        while pos < index:
+            if not self.cap.grab():
+                return False
+            pos += 1
+        return True
+
+    def _read_backfill(self, index):
+        ''' 从index-backfill顺序解码到index，沿途帧全部写入缓存 '''
+        start = max(0, index - self.backfill)
+        if not self._seek_grab(start):
+            self.next_index = -1
+            return False, None
+        ret, frame = False, None
+        for i in range(start, index + 1):
+            ret, frame = self.cap.retrieve() if i == start else self.cap.read()
+            if not ret:
+                self.next_index = -1
+                return False, None
+            self.frame_cache.put(self.video_path, i, frame)
+        self.next_index = index + 1
+        return ret, frame
+
+    def release(self):
+        ''' 释放解码器 '''
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        self.opened = False
+        self.next_index = -1
+
+def local_cache_dir(name):
+    ''' 本地缓存目录，如代理视频、缩略图 '''
+    return os.path.join(os.path.expanduser("~"), ".behavilabel", name)
+
+def video_cache_key(video_path):
+    ''' 由源路径、大小和修改时间生成缓存键，源文件变化后缓存自动失效 '''
+    stat = os.stat(video_path)
+    key = f"{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+class ProxyManager:
+    ''' 后台把高分辨率视频转码为低分辨率全帧内(MJPG)代理，帧号与源视频一一对应；
+    代理目录超过max_bytes时按最近使用时间淘汰，正在使用的代理不淘汰 '''
+    def __init__(self, max_width, max_height, cache_dir=None, max_bytes=4 * 1024 ** 3):
+        self.max_width = max_width
+        self.max_height = max_height
+        self.cache_dir = cache_dir or local_cache_dir("proxy")
+        self.max_bytes = max_bytes
+        self.enabled = False  # 是否从代理播放
+        self.proxies = {}  # 源视频路径 -> 代理信息
+        self.retained = set()  # 当前需要的源视频，不会被淘汰
+        self.queued = set()
+        self.requests = queue.LifoQueue()  # 后请求的先处理，保证当前视频优先
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def get(self, video_path):
+        ''' 返回已就绪的代理信息，未启用或尚未生成时返回None '''
+        if not self.enabled:
+            return None
+        return self.proxies.get(video_path)
+
+    def request(self, video_path):
+        ''' 排队生成代理，重复请求只会提高优先级 '''
+        with self.lock:
+            if video_path in self.proxies:
+                return
+            self.queued.add(video_path)
+        self.requests.put(video_path)
+
+    def retain(self, video_paths):
+        ''' 只保留这些视频的排队请求，其余请求作废；这些视频的代理在淘汰时保留 '''
+        with self.lock:
+            self.retained = set(video_paths)
+            self.queued &= self.retained
+
+    def proxy_paths(self, video_path):
+        ''' 代理文件路径和元数据路径 '''
+        base = os.path.join(self.cache_dir, video_cache_key(video_path))
+        return base + ".avi", base + ".json"
+
+    def _run(self):
+        while True:
+            video_path = self.requests.get()
+            with self.lock:
+                if video_path not in self.queued:
+                    continue  # 重复请求已处理过
+                self.queued.discard(video_path)
+            try:
+                proxy = self._load(video_path) or self._build(video_path)
+            except Exception as e:
+                print(f"生成代理失败: {e}")
+                proxy = None
+            if proxy is not None:
+                with self.lock:
+                    self.proxies[video_path] = proxy
+                self._evict()
+
+    def _load(self, video_path):
+        proxy_path, info_path = self.proxy_paths(video_path)
+        if not (os.path.exists(proxy_path) and os.path.exists(info_path)):
+            return None
+        with open(info_path, 'r', encoding='utf-8') as f:
+            proxy = json.load(f)
+        os.utime(info_path)  # 元数据文件的修改时间即最近使用时间
+        return proxy
+
+    def _evict(self):
+        ''' 代理目录超出容量时，从最久未使用的代理开始删除 '''
+        with self.lock:
+            keep = {os.path.normpath(self.proxy_paths(path)[1]) for path in self.retained if path in self.proxies}
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            info_path = os.path.join(self.cache_dir, name)
+            proxy_path = info_path[:-len(".json")] + ".avi"
+            try:
+                size = os.path.getsize(proxy_path) if os.path.exists(proxy_path) else 0
+                entries.append((os.path.getmtime(info_path), info_path, proxy_path))
+            except OSError:
+                continue
+            total += size
+        for _, info_path, proxy_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if os.path.normpath(info_path) in keep:
+                continue
+            try:
+                size = os.path.getsize(proxy_path) if os.path.exists(proxy_path) else 0
+                os.remove(info_path)
+                if os.path.exists(proxy_path):
+                    os.remove(proxy_path)
+            except OSError:
+                continue  # 代理文件仍被打开时跳过
+            total -= size
+            with self.lock:
+                for path in [path for path, proxy in self.proxies.items() if proxy["path"] == proxy_path]:
+                    del self.proxies[path]
+
+    def _build(self, video_path):
+        proxy_path, info_path = self.proxy_paths(video_path)
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return None
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        ratio = min(self.max_width / width, self.max_height / height, 1.0)
+        size = (max(2, int(width * ratio)), max(2, int(height * ratio)))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = proxy_path[:-len(".avi")] + ".tmp.avi"
+        writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+        # 逐帧顺序转码，每个源帧恰好写入一帧，保证帧号一一对应
+        frames = 0
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if ratio < 1.0:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                writer.write(frame)
+                frames += 1
+        finally:
+            writer.release()
+            cap.release()
+        if frames == 0:
+            os.remove(tmp_path)
+            return None
+
+        os.replace(tmp_path, proxy_path)
+        proxy = {"path": proxy_path, "width": width, "height": height, "fps": fps, "frames": frames}
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(proxy, f)
+        return proxy
+
+class ThumbnailGenerator:
+    ''' 后台为视频生成均匀分布的缩略图，并按视频缓存到本地磁盘 '''
+    def __init__(self, count=60, max_width=192, max_height=108, cache_dir=None):
+        self.count = count
+        self.max_width = max_width
+        self.max_height = max_height
+        self.cache_dir = cache_dir or local_cache_dir("thumbs")
+        self.thumbnails = {}  # 视频路径 -> (帧号数组, 缩略图数组N*H*W*3)
+        self.queued = set()
+        self.requests = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def get(self, video_path):
+        ''' 返回(帧号数组, 缩略图数组)，尚未生成时返回None '''
+        return self.thumbnails.get(video_path)
+
+    def request(self, video_path):
+        with self.lock:
+            if video_path in self.thumbnails:
+                return
+            self.queued.add(video_path)
+        self.requests.put(video_path)
+
+    def _run(self):
+        while True:
+            video_path = self.requests.get()
+            with self.lock:
+                if video_path not in self.queued:
+                    continue
+                self.queued.discard(video_path)
+            try:
+                result = self._load(video_path) or self._build(video_path)
+            except Exception as e:
+                print(f"生成缩略图失败: {e}")
+                result = None
+            if result is not None:
+                with self.lock:
+                    self.thumbnails[video_path] = result
+
+    def _cache_path(self, video_path):
+        return os.path.join(self.cache_dir, video_cache_key(video_path) + f"_{self.count}.npz")
+
+    def _load(self, video_path):
+        cache_path = self._cache_path(video_path)
+        if not os.path.exists(cache_path):
+            return None
+        with np.load(cache_path) as data:
+            return data['indices'], data['thumbs']
+
+    def _build(self, video_path):
+        reader = VideoReader(video_path)
+        try:
+            if not reader.opened or reader.total_frames <= 0:
+                return None
+            ratio = min(self.max_width / reader.width, self.max_height / reader.height)
+            size = (max(1, int(reader.width * ratio)), max(1, int(reader.height * ratio)))
+            indices = np.unique(np.linspace(0, reader.total_frames - 1, self.count).astype(np.int64))
+            thumbs = np.zeros((len(indices), size[1], size[0], 3), dtype=np.uint8)
+            for i, index in enumerate(indices):
+                ret, frame = reader.read(int(index))
+                if ret:
+                    cv2.resize(frame, size, dst=thumbs[i], interpolation=cv2.INTER_AREA)
+        finally:
+            reader.release()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self._cache_path(video_path)
+        with open(cache_path + ".tmp", 'wb') as f:
+            np.savez_compressed(f, indices=indices, thumbs=thumbs)
+        os.replace(cache_path + ".tmp", cache_path)
+        return indices, thumbs
+
+def pack_detections(frames, detections):
+    ''' 把逐帧的(检测框, 置信度, 关键点)拼成紧凑数组，第i帧的结果为offsets[i]:offsets[i+1]行 '''
+    offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+    np.cumsum([len(d[1]) for d in detections], out=offsets[1:])
+    rows = [d for d in detections if len(d[1]) > 0]
+    return {
+        "frames": np.asarray(frames, dtype=np.int64),
+        "offsets": offsets,
+        "boxes": np.concatenate([d[0] for d in rows]).astype(np.float32) if rows else np.zeros((0, 4), np.float32),
+        "scores": np.concatenate([d[1] for d in rows]).astype(np.float32) if rows else np.zeros(0, np.float32),
+        "kpts": np.concatenate([d[2] for d in rows]).astype(np.float32) if rows else np.zeros((0, 0), np.float32),
+    }
+
+class KeypointCache:
+    ''' 骨骼检测结果缓存：内存中按视频做LRU，磁盘上每个(视频, 模型)保存一个紧凑数组文件 '''
+    CONF_FLOOR = 0.1  # 缓存按此阈值过滤的结果，读取时再按当前阈值筛选
+
+    def __init__(self, max_videos=4, flush_every=200, cache_dir=None):
+        self.cache_dir = cache_dir or local_cache_dir("keypoints")
+        self.max_videos = max_videos
+        self.flush_every = flush_every  # 每新增这么多帧的结果写一次盘
+        self.tables = OrderedDict()  # (视频路径, 模型哈希) -> {帧号: (检测框, 置信度, 关键点)}
+        self.unsaved = {}  # (视频路径, 模型哈希) -> 尚未写盘的结果数
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def empty():
+        ''' 未检测到目标时缓存的空结果 '''
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros((0, 0), np.float32)
+
+    def cache_path(self, video_path, model_hash):
+        return os.path.join(self.cache_dir, f"{video_cache_key(video_path)}_{model_hash[:16]}.npz")
+
+    def get(self, video_path, model_hash, index):
+        ''' 返回(检测框, 置信度, 关键点)，坐标为源视频分辨率；未缓存时返回None '''
+        with self.lock:
+            return self._table((video_path, model_hash)).get(index)
+
+    def put(self, video_path, model_hash, index, detections):
+        table_key = (video_path, model_hash)
+        with self.lock:
+            self._table(table_key)[index] = tuple(np.asarray(a, dtype=np.float32) for a in detections)
+            self.unsaved[table_key] = self.unsaved.get(table_key, 0) + 1
+            if self.unsaved[table_key] >= self.flush_every:
+                self._save(table_key)
+
+    def flush(self):
+        ''' 把所有未写盘的结果写入磁盘 '''
+        with self.lock:
+            for table_key in list(self.unsaved):
+                self._save(table_key)
+
+    def _table(self, table_key):
+        table = self.tables.get(table_key)
+        if table is not None:
+            self.tables.move_to_end(table_key)
+            return table
+        table = self._load(table_key)
+        self.tables[table_key] = table
+        while len(self.tables) > self.max_videos:
+            old_key = next(iter(self.tables))
+            if old_key in self.unsaved:
+                self._save(old_key)
+            del self.tables[old_key]
+        return table
+
+    def _load(self, table_key):
+        table = {}
+        try:
+            path = self.cache_path(*table_key)
+            if not os.path.exists(path):
+                return table
+            with np.load(path) as data:
+                frames, offsets = data["frames"], data["offsets"]
+                boxes, scores, kpts = data["boxes"], data["scores"], data["kpts"]
+        except Exception as e:
+            print(f"读取关键点缓存失败: {e}")
+            return table
+        # 各帧的结果是整体数组的切片视图，不额外占用内存
+        for i, index in enumerate(frames.tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            table[index] = (boxes[start:end], scores[start:end], kpts[start:end])
+        return table
+
+    def _save(self, table_key):
+        self.unsaved.pop(table_key, None)
+        table = self.tables.get(table_key)
+        if not table:
+            return
+        frames = sorted(table)
+        try:
+            path = self.cache_path(*table_key)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **pack_detections(frames, [table[index] for index in frames]))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"保存关键点缓存失败: {e}")
+
+class FrameScaler:
+    ''' 显示缩放：比例和偏移按视频尺寸只计算一次，用INTER_AREA缩放到预分配的环形缓冲区 '''
+    def __init__(self, display_width, display_height, buffer_count):
+        self.display_width = display_width
+        self.display_height = display_height
+        self.buffer_count = buffer_count  # 需大于同时在队列中和显示中的帧数
+        self.source_size = None
+        self.new_width = 0
+        self.new_height = 0
+        self.x_offset = 0
+        self.y_offset = 0
+        self.buffers = []
+        self.next_buffer = 0
+
+    def configure(self, width, height):
+        ''' 源尺寸变化时重新计算缩放参数并分配缓冲区 '''
+        if self.source_size == (width, height):
+            return
+        ratio = min(self.display_width / width, self.display_height / height)
+        self.new_width = int(width * ratio)
+        self.new_height = int(height * ratio)
+        self.x_offset = (self.display_width - self.new_width) // 2
+        self.y_offset = (self.display_height - self.new_height) // 2
+        self.buffers = [np.empty((self.new_height, self.new_width, 3), dtype=np.uint8)
+                        for _ in range(self.buffer_count)]
+        self.next_buffer = 0
+        self.source_size = (width, height)
+
+    def scale(self, frame):
+        ''' 缩放到下一个空闲缓冲区并返回该缓冲区(仍为BGR) '''
+        height, width = frame.shape[:2]
+        self.configure(width, height)
+        buffer = self.buffers[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % self.buffer_count
+        cv2.resize(frame, (self.new_width, self.new_height), dst=buffer, interpolation=cv2.INTER_AREA)
+        return buffer
+
+class PlaybackClock:
+    ''' 播放时钟：按源帧率乘以倍速推进目标帧号，落后时跳帧而不是放慢 '''
+    def __init__(self, default_fps=25.0):
+        self.default_fps = default_fps  # 视频未提供帧率时使用
+        self.fps = default_fps
+        self.speed = 1
+        self.start_frame = 0
+        self.start_time = time.perf_counter()
+        self.display_times = deque(maxlen=240)  # 最近实际显示帧的时刻
+
+    def reset(self, start_frame, fps, speed):
+        ''' 从start_frame开始重新计时 '''
+        self.fps = fps if fps > 0 else self.default_fps
+        self.speed = speed
+        self.start_frame = start_frame
+        self.start_time = time.perf_counter()
+        self.display_times.clear()
+
+    def target_frame(self, now):
+        ''' 当前时刻应显示的源帧号 '''
+        return self.start_frame + int((now - self.start_time) * self.fps * self.speed)
+
+    def time_until(self, index, now):
+        ''' 距离index帧应显示时刻的秒数 '''
+        return self.start_time + (index - self.start_frame) / (self.fps * self.speed) - now
+
+    def mark_displayed(self, now):
+        self.display_times.append(now)
+
+    def achieved_fps(self, now):
+        ''' 最近一秒内实际显示的帧率 '''
+        while self.display_times and now - self.display_times[0] > 1.0:
+            self.display_times.popleft()
+        return len(self.display_times)
+
+def read_annotation_records(record_file):
+    ''' 读取标注txt，返回"起始帧-结束帧: 行为"格式的记录列表 '''
+    records = []
+    with open(record_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                # 解析标注记录 (格式: 起始帧 结束帧 行为)
+                parts = line.split()
+                if len(parts) >= 3:
+                    start_frame = parts[0]
+                    end_frame = parts[1]
+                    behavior = ' '.join(parts[2:])  # 处理行为名称中可能包含空格的情况
+                    records.append(f"{start_frame}-{end_frame}: {behavior}")
+    return records
+
+def probe_video(video_path):
+    ''' 探测视频元数据；已有索引旁路缓存时以索引的帧数为准 '''
+    stat = os.stat(video_path)
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime,
+             "width": 0, "height": 0, "fps": 0.0, "frames": 0}
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if cap.isOpened():
+            entry["width"] = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            entry["height"] = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            entry["fps"] = cap.get(cv2.CAP_PROP_FPS) or 0.0
+            entry["frames"] = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+    video_index = load_video_index(video_path)
+    if video_index is not None:
+        entry["frames"] = video_index.total_frames
+    return entry
+
+def count_label_records(save_dir, video_path):
+    ''' 统计视频对应标注txt中的记录数 '''
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    record_file = os.path.join(save_dir, f"{video_name}.txt")
+    if not os.path.exists(record_file):
+        return 0
+    return len(read_annotation_records(record_file))
+
+class VideoCatalog:
+    ''' 视频元数据目录：线程池并行探测，按路径/大小/修改时间缓存到视频目录下 '''
+    CATALOG_NAME = ".behavilabel_catalog.json"
+
+    def __init__(self, video_dir, max_workers=None):
+        self.video_dir = video_dir
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self.entries = {}  # 相对路径 -> 元数据
+        self.label_counts = {}  # 视频路径 -> 标注记录数
+        self.probed = 0
+        self.total = 0
+        self.done = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def catalog_path(self):
+        return os.path.join(self.video_dir, self.CATALOG_NAME)
+
+    def load(self):
+        if not os.path.exists(self.catalog_path()):
+            return
+        try:
+            with open(self.catalog_path(), 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get("videos", {})
+        except Exception as e:
+            print(f"读取视频目录缓存失败: {e}")
+
+    def save(self):
+        ''' 写入缓存文件，视频目录不可写时忽略 '''
+        tmp_path = self.catalog_path() + ".tmp"
+        try:
+            with self.lock:
+                data = {"version": 1, "videos": dict(self.entries)}
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.catalog_path())
+        except Exception as e:
+            print(f"保存视频目录缓存失败: {e}")
+
+    def get(self, video_path):
+        ''' 返回仍然有效的元数据，视频已变化或未探测时返回None '''
+        entry = self.entries.get(os.path.relpath(video_path, self.video_dir))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(video_path)
+        except OSError:
+            return None
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            return None
+        return entry
+
+    def probe_all(self, video_paths, save_dir=None):
+        ''' 并行探测所有未缓存或已变化的视频，同时统计标注记录数；在后台线程中调用 '''
+        stale = [path for path in video_paths if self.get(path) is None]
+        self.total = len(video_paths)
+        self.probed = self.total - len(stale)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(probe_video, path): path for path in stale}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    entry = future.result()
+                    with self.lock:
+                        self.entries[os.path.relpath(path, self.video_dir)] = entry
+                except Exception as e:
+                    print(f"探测视频失败: {path} {e}")
+                self.probed += 1
+        if stale:
+            self.save()
+        if save_dir:
+            for path in video_paths:
+                try:
+                    self.label_counts[path] = count_label_records(save_dir, path)
+                except Exception:
+                    pass
+        self.done = True
+
+class VideoPreloader:
+    ''' 后台预先打开相邻视频、解码开头若干帧并读取其标注记录，切换视频时直接接管 '''
+    def __init__(self, frame_cache=None, indexer=None, proxy_manager=None, warm_frames=8, max_readers=2):
+        self.frame_cache = frame_cache
+        self.indexer = indexer
+        self.proxy_manager = proxy_manager
+        self.warm_frames = warm_frames
+        self.max_readers = max_readers
+        self.readers = OrderedDict()  # 解码路径 -> 已打开并预热的VideoReader
+        self.records = {}  # 标注文件路径 -> (大小, 修改时间, 记录列表)
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def decode_path(self, video_path):
+        ''' 实际解码的文件路径，代理就绪时为代理路径 '''
+        proxy = self.proxy_manager.get(video_path) if self.proxy_manager is not None else None
+        return proxy["path"] if proxy else video_path
+
+    def preload(self, jobs):
+        ''' jobs为[(视频路径, 标注文件路径或None)]，只处理最近一次请求 '''
+        self.requests.put(jobs)
+
+    def take(self, decode_path):
+        ''' 取走预热好的解码会话，之后由调用方独占 '''
+        with self.lock:
+            return self.readers.pop(decode_path, None)
+
+    def get_records(self, record_file):
+        ''' 返回预读的标注记录，文件已变化或未预读时返回None '''
+        cached = self.records.get(record_file)
+        if cached is None:
+            return None
+        try:
+            stat = os.stat(record_file)
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_mtime) != cached[:2]:
+            return None
+        return list(cached[2])
+
+    def _run(self):
+        while True:
+            jobs = self.requests.get()
+            # 快速连续切换时只处理最新的请求
+            while True:
+                try:
+                    jobs = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+            for video_path, record_file in jobs:
+                try:
+                    if record_file and os.path.exists(record_file):
+                        stat = os.stat(record_file)
+                        self.records[record_file] = (stat.st_size, stat.st_mtime,
+                                                     read_annotation_records(record_file))
+                    self._warm(self.decode_path(video_path))
+                except Exception as e:
+                    print(f"预加载失败: {e}")
+
+    def _warm(self, decode_path):
+        with self.lock:
+            if decode_path in self.readers:
+                self.readers.move_to_end(decode_path)
+                return
+        reader = VideoReader(decode_path, frame_cache=self.frame_cache)
+        if not reader.opened:
+            return
+        if self.indexer is not None:
+            self.indexer.request(decode_path)
+        for i in range(self.warm_frames):
+            if not reader.read(i)[0]:
+                break
+        with self.lock:
+            self.readers[decode_path] = reader
+            while len(self.readers) > self.max_readers:
+                self.readers.popitem(last=False)[1].release()
+
+class FramePrefetcher:
+    ''' 后台解码线程：按播放方向和倍速提前解码并处理帧，放入有界队列供Tk主线程显示 '''
+    def __init__(self, process_frame, frame_cache=None, indexer=None, proxy_manager=None, preloader=None,
+                 queue_size=8):
+        self.process_frame = process_frame  # 在后台线程中把BGR帧处理成可直接显示的图像
+        self.frame_cache = frame_cache
+        self.indexer = indexer
+        self.proxy_manager = proxy_manager
+        self.preloader = preloader
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.cond = threading.Condition()
+        self.generation = 0  # 每次重新设定解码起点时递增，用于丢弃过期结果
+        self.pending = False
+        self.video_path = None
+        self.next_index = 0
+        self.step = 1
+        self.playing = False
+        self.reader = None  # 只在后台线程中访问
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def request(self, video_path, index, step=1, playing=False):
+        ''' 设定新的解码起点；playing为False时只解码这一帧，step为负表示倒放 '''
+        with self.cond:
+            self.generation += 1
+            self.video_path = video_path
+            self.next_index = index
+            self.step = step
+            self.playing = playing
+            self.pending = True
+            while True:
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    break
+            self.cond.notify()
+
+    def get(self):
+        ''' 非阻塞取出一帧当前有效的结果，没有就绪的帧时返回None '''
+        while True:
+            try:
+                item = self.frames.get_nowait()
+            except queue.Empty:
+                return None
+            if item['generation'] == self.generation:
+                return item
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                generation = self.generation
+                video_path = self.video_path
+                index = self.next_index
+                step = self.step
+                playing = self.playing
+
+            item = self._decode(video_path, index)
+            item['generation'] = generation
+            item['playing'] = playing
+            # 队列满时等待主线程消费，期间若重新设定了起点则直接丢弃
+            while generation == self.generation:
+                try:
+                    self.frames.put(item, timeout=0.05)
+                    break
+                except queue.Full:
+                    pass
 
-    # 获取所有txt文件并预计算总记录数
+            with self.cond:
+                if generation == self.generation:
+                    if playing and item['image'] is not None:
+                        self.next_index = index + step
+                    else:
+                        self.pending = False
+
+    def _decode(self, video_path, index):
+        # 代理就绪时从代理解码，帧号不变，尺寸仍报告源视频的尺寸
+        proxy = self.proxy_manager.get(video_path) if self.proxy_manager is not None else None
+        decode_path = proxy["path"] if proxy else video_path
+        if self.reader is None or self.reader.video_path != decode_path:
+            if self.reader is not None:
+                self.reader.release()
+            self.reader = self.preloader.take(decode_path) if self.preloader is not None else None
+            if self.reader is None:
+                self.reader = VideoReader(decode_path, frame_cache=self.frame_cache)
+            if self.indexer is not None:
+                self.indexer.request(decode_path)
+        reader = self.reader
+        if reader.index is None and self.indexer is not None:
+            video_index = self.indexer.get(decode_path)
+            if video_index is not None:
+                reader.set_index(video_index)
+        item = {
+            "video_path": video_path,
+            "index": index,
+            "image": None,  # 处理后的显示帧，None表示读取失败或已到视频首尾
+            "frame": None,  # 解码得到的原始帧，供骨骼推理使用
+            "width": proxy["width"] if proxy else reader.width,
+            "height": proxy["height"] if proxy else reader.height,
+            "total_frames": reader.total_frames,
+            "fps": reader.fps,
+        }
+        if not reader.opened or index < 0 or (reader.total_frames > 0 and index >= reader.total_frames):
+            return item
+        ret, frame = reader.read(index)
+        if ret:
+            item["frame"] = frame
+            try:
+                item["image"] = self.process_frame(frame)
+            except Exception as e:
+                print(f"帧处理出错: {e}")
+        return item
+
+def parse_clip_line(line, crop):
+    """解析记录（格式: start_frame end_frame action [x1,y1,x2,y2]），无效记录返回None"""
+    parts = line.split()
+    if len(parts) < 3:
+        return None
+    try:
+        start_frame = int(parts[0])
+        end_frame = int(parts[1])
+    except ValueError:
+        return None
+    selection = None
+
+    # 解析框选坐标
+    if len(parts) >= 4 and ',' in parts[3] and crop:
+        try:
+            coords = list(map(int, parts[3].split(',')))
+            if coords[0] < coords[2] and coords[1] < coords[3]:
+                selection = coords
+        except:
+            pass
+    return {"start": start_frame, "end": end_frame, "action": parts[2], "selection": selection}
+
+def clip_output_path(output_dir, video_name, clip):
+    """片段的输出路径：按行为分目录，文件名包含帧范围和裁剪区域"""
+    selection = clip["selection"]
+    output_name = (
+        f"{video_name}_{clip['start']}_{clip['end']}_{clip['action']}"
+        f"{f'_{selection[0]}_{selection[1]}_{selection[2]}_{selection[3]}' if selection else ''}.mp4"
+    )
+    return os.path.join(output_dir, clip["action"], output_name)
+
+def find_label_videos(video_dir):
+    """按文件名(不含扩展名)索引视频目录下的全部视频，包括子目录；返回(文件名->路径, 重名视频列表)。
+    标注文件按文件名保存，重名时与视频列表一致只取扫描顺序中的第一个，其余视频被忽略"""
+    videos = {}
+    duplicates = []
+    for video_path in list_videos(video_dir):
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        if video_name in videos:
+            duplicates.append(video_path)
+        else:
+            videos[video_name] = video_path
+    return videos, duplicates
+
+class ClipShard:
+    ''' 训练用的片段数组分片：一个视频的全部片段写入一个uint8的.npy文件，可用np.load(mmap_mode='r')直接映射；
+    形状为(片段数, 帧数, 高, 宽, 3)，RGB顺序，第i行对应第i个片段 '''
+    def __init__(self, path, clip_count, frame_count, size):
+        self.path = path
+        self.frame_count = frame_count
+        self.size = size  # (宽, 高)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.tmp_path = path + ".tmp"
+        self.data = np.lib.format.open_memmap(self.tmp_path, mode='w+', dtype=np.uint8,
+                                              shape=(clip_count, frame_count, size[1], size[0], 3))
+
+    def clip(self, row, clip):
+        return ClipShardWriter(self, row, clip)
+
+    def close(self):
+        self.data.flush()
+        del self.data
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        del self.data
+        os.remove(self.tmp_path)
+
+class ClipShardWriter:
+    ''' 与VideoWriter接口相同的片段写入器：在片段区间内均匀取固定帧数，缩放后写入分片的一行；
+    帧数不足时重复取帧，视频提前结束时用最后写入的帧补齐，空片段保持全零 '''
+    def __init__(self, shard, row, clip):
+        self.frames = shard.data[row]
+        self.size = shard.size
+        length = clip["end"] - clip["start"] + 1
+        self.slots = np.linspace(0, length - 1, shard.frame_count).round().astype(np.int64) if length > 0 else []
+        self.filled = 0  # 已写入的槽位数
+        self.offset = 0  # 当前帧在片段中的位置
+
+    def write(self, frame):
+        first = self.filled
+        while self.filled < len(self.slots) and self.slots[self.filled] == self.offset:
+            if self.filled == first:
+                dst = self.frames[self.filled]
+                cv2.resize(frame, self.size, dst=dst, interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(dst, cv2.COLOR_BGR2RGB, dst=dst)
+            else:
+                self.frames[self.filled] = self.frames[first]
+            self.filled += 1
+        self.offset += 1
+
+    def release(self):
+        if 0 < self.filled < len(self.slots):
+            self.frames[self.filled:] = self.frames[self.filled - 1]
+
+def export_video_clips(video_path, clips, output_paths, entry, on_clip_done=None, cancel=None, shard=None):
+    """按起始帧排序后顺序解码视频一遍，把每一帧写入区间包含它的所有片段；片段之间的空隙由VideoReader
+    决定grab跳过还是seek。on_clip_done(片段, 已解码帧数)在每个片段完成时回调；只在开始新片段前检查取消，
+    已开始的片段照常写完，尚未开始的片段不再生成。给出shard时片段写入ClipShard的对应行而不是mp4文件。
+    返回解码的帧数"""
+    order = sorted(range(len(clips)), key=lambda i: (clips[i]["start"], clips[i]["end"]))
+    pending = deque(order)
+    active = []  # 正在写入的(片段序号, VideoWriter)
+    reader = VideoReader(video_path)
+    video_index = load_video_index(video_path)
+    if video_index is not None:
+        reader.set_index(video_index)
+
+    def open_writer(i):
+        if shard is not None:
+            return shard.clip(i, clips[i])
+        clip = clips[i]
+        selection = clip["selection"]
+        os.makedirs(os.path.dirname(output_paths[i]), exist_ok=True)
+        width = (selection[2] - selection[0]) if selection else entry["width"]
+        height = (selection[3] - selection[1]) if selection else entry["height"]
+        return cv2.VideoWriter(output_paths[i], cv2.VideoWriter_fourcc(*'mp4v'), entry["fps"], (width, height))
+
+    def close_writer(i, writer):
+        writer.release()
+        if on_clip_done is not None:
+            on_clip_done(clips[i], decoded)
+
+    index = 0
+    decoded = 0
+    cancelled = False
+    try:
+        while pending or active:
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                if not active:
+                    break
+            if not active:
+                index = max(index, clips[pending[0]]["start"])  # 跳过不属于任何片段的帧
+            # 打开从当前帧开始的片段
+            while pending and not cancelled and clips[pending[0]]["start"] <= index:
+                i = pending.popleft()
+                writer = open_writer(i)
+                if clips[i]["end"] < index:
+                    close_writer(i, writer)  # 结束帧在起始帧之前，输出空片段
+                else:
+                    active.append((i, writer))
+            if not active:
+                continue
+
+            ret, frame = reader.read(index)
+            if not ret:
+                break
+            decoded += 1
+            still_active = []
+            for i, writer in active:
+                selection = clips[i]["selection"]
+                if selection:
+                    writer.write(frame[selection[1]:selection[3], selection[0]:selection[2]])
+                else:
+                    writer.write(frame)
+                if clips[i]["end"] <= index:
+                    close_writer(i, writer)
+                else:
+                    still_active.append((i, writer))
+            active = still_active
+            index += 1
+    finally:
+        # 视频提前结束时，剩余片段照常收尾；取消时未开始的片段不生成
+        for i, writer in active:
+            close_writer(i, writer)
+        if not cancelled:
+            for i in pending:
+                close_writer(i, open_writer(i))
+        reader.release()
+    return decoded
+
+class ExportManifest:
+    ''' 导出清单：记录输出目录中已生成的片段，以标记行、源视频大小/修改时间和导出选项的哈希为键，
+    值为相对输出目录的文件路径、视频名和标记行；据此跳过未变化的片段、删除标记已移除的片段，中断后从断点继续 '''
+    MANIFEST_NAME = ".behavilabel_export.json"
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.entries = {}  # 键 -> {"output": 相对路径, "video": 视频名, "lines": 标记行}
+        self.txt_dir = None  # 上次导出使用的TXT目录
+        self.dirty = False
+        self.load()
+
+    def manifest_path(self):
+        return os.path.join(self.output_dir, self.MANIFEST_NAME)
+
+    def load(self):
+        if not os.path.exists(self.manifest_path()):
+            return
+        try:
+            with open(self.manifest_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get("clips", {})
+            self.txt_dir = data.get("txt_dir")
+        except Exception as e:
+            print(f"读取导出清单失败: {e}")
+
+    def save(self):
+        tmp_path = self.manifest_path() + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": 1, "txt_dir": self.txt_dir, "clips": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path())
+        self.dirty = False
+
+    @staticmethod
+    def key(video_name, lines, entry, options):
+        ''' 片段(或整个分片)的键：标记行、源视频的大小和修改时间、导出选项任一变化都会得到新键 '''
+        data = json.dumps([video_name, lines, entry["size"], entry["mtime"], options])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def set_txt_dir(self, txt_dir):
+        if self.txt_dir != txt_dir:
+            self.txt_dir = txt_dir
+            self.dirty = True
+
+    def has(self, key):
+        return key in self.entries and os.path.exists(os.path.join(self.output_dir, self.entries[key]["output"]))
+
+    def add(self, key, output_path, video_name, lines):
+        ''' 记录生成的文件，同一文件的旧记录(如源视频变化前的)被替换 '''
+        output = os.path.relpath(output_path, self.output_dir).replace(os.sep, "/")
+        for old_key in [k for k, e in self.entries.items() if e["output"] == output and k != key]:
+            del self.entries[old_key]
+        self.entries[key] = {"output": output, "video": video_name, "lines": lines}
+        self.dirty = True
+
+    def remove_orphans(self, label_lines):
+        ''' 删除标记行已全部不存在的记录及其文件；label_lines为本次找到的视频名 -> 当前有效标记行集合，
+        标记被清空或删除的视频为空集合，其余视频(找不到或无法打开)的记录一律保留，导出选项不影响判断。
+        返回删除的文件数 '''
+        orphans = [key for key, e in self.entries.items()
+                   if e["video"] in label_lines and not any(line in label_lines[e["video"]] for line in e["lines"])]
+        if not orphans:
+            return 0
+        removed_outputs = {self.entries.pop(key)["output"] for key in orphans}
+        self.dirty = True
+        # 仍被其他记录使用的文件不删除
+        removed_outputs -= {e["output"] for e in self.entries.values()}
+        removed = 0
+        for output in removed_outputs:
+            path = os.path.join(self.output_dir, output)
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        return removed
+
+def plan_export(video_dir, txt_dir, output_dir, crop, catalog=None):
+    """读取全部TXT文件，按视频整理待导出的片段；返回(任务列表, 记录总数, 跳过的记录数, 被忽略的重名视频, 标记行)，
+    每个任务对应一个视频，找不到视频或无效的记录计入跳过数；标记行为视频名 -> 有效标记行集合，
+    包含能打开的已标记视频和没有有效标记的视频(集合为空)，没有TXT文件的视频为None，无法打开的视频不包含。
+    没有TXT文件或没有记录时抛出RuntimeError"""
     txt_files = [f for f in os.listdir(txt_dir) if f.endswith('.txt')]
     if not txt_files:
-        status_label.config(text="错误：未找到TXT文件")
-        return False
-
-    # ==== 关键修改：统计所有文件的记录总数 ====
+        raise RuntimeError("未找到TXT文件")
+    jobs = []
     total_clips = 0
-    clip_info = []  # 存储每个文件的记录数和路径
+    skipped = 0
+    videos, duplicates = find_label_videos(video_dir)
+    label_lines = dict.fromkeys(videos)
     for txt_file in txt_files:
-        txt_path = os.path.join(txt_dir, txt_file)
-        with open(txt_path, 'r') as f:
+        with open(os.path.join(txt_dir, txt_file), 'r') as f:
             lines = [line.strip() for line in f if line.strip()]
-            clip_info.append({
-                "file": txt_file,
-                "path": txt_path,
-                "lines": lines,
-                "count": len(lines)
-            })
-            total_clips += len(lines)
-
-    if total_clips == 0:
-        status_label.config(text="错误：TXT文件中无有效记录")
-        return False
-
-    # 初始化进度
-    current_clip = 0
-    start_time = time.time()
-
-    # 处理每个TXT文件
-    for info in clip_info:
-        txt_file = info["file"]
-        lines = info["lines"]
+        total_clips += len(lines)
 
         # 查找对应的视频文件
         video_name = os.path.splitext(txt_file)[0]
-        video_path = None
-        for ext in ['.mp4', '.avi', '.mov', '.mkv']:
-            test_path = os.path.join(video_dir, f"{video_name}{ext}")
-            if os.path.exists(test_path):
-                video_path = test_path
-                break
-
+        video_path = videos.get(video_name)
         if not video_path:
-            current_clip += info["count"]  # 跳过无效文件但仍更新进度
-            continue
-
-        # 读取视频
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            current_clip += info["count"]
+            skipped += len(lines)
             continue
 
-        # 处理每条记录
+        # 解析记录，同一输出文件只写一次
+        clips = []
+        output_paths = []
         for line in lines:
-            current_clip += 1
-            progress = current_clip / total_clips * 100
-            progress_var.set(progress)
-
-            # 计算时间信息
-            elapsed = time.time() - start_time
-            avg_time = elapsed / current_clip
-            remaining = max(0, avg_time * (total_clips - current_clip))
-
-            # 更新状态
-            status_label.config(
-                text=f"处理: {video_name} | 进度: {current_clip}/{total_clips} | "
-                     f"已用: {time.strftime('%H:%M:%S', time.gmtime(elapsed))} | "
-                     f"剩余: {time.strftime('%H:%M:%S', time.gmtime(remaining))}"
-            )
-            top_window.update_idletasks()
-
-            # 解析记录（格式: start_frame end_frame action [x1,y1,x2,y2]）
-            parts = line.split()
-            if len(parts) < 3:
+            clip = parse_clip_line(line, crop)
+            if clip is not None:
+                clip["line"] = line
+            output_path = clip_output_path(output_dir, video_name, clip) if clip is not None else None
+            if output_path is None or output_path in output_paths:
+                skipped += 1
                 continue
+            clips.append(clip)
+            output_paths.append(output_path)
+        if not clips:
+            label_lines[video_name] = set()
+            continue
 
-            start_frame = int(parts[0])
-            end_frame = int(parts[1])
-            action = parts[2]
-            selection = None
+        # 视频目录已探测过时直接使用缓存的元数据
+        entry = catalog.get(video_path) if catalog is not None else None
+        if entry is None:
+            entry = probe_video(video_path)
+        if entry["width"] <= 0:
+            skipped += len(clips)  # 视频无法打开
+            del label_lines[video_name]
+            continue
+        label_lines[video_name] = {clip["line"] for clip in clips}
+        jobs.append({"video_name": video_name, "video_path": video_path, "clips": clips,
+                     "output_paths": output_paths, "entry": entry})
+    if total_clips == 0:
+        raise RuntimeError("TXT文件中无有效记录")
+    return jobs, total_clips, skipped, duplicates, label_lines
+
+_export_updates = None  # 导出工作进程向主进程汇报进度的队列
+_export_cancel = None
+
+def _init_export_worker(updates, cancel):
+    global _export_updates, _export_cancel
+    _export_updates = updates
+    _export_cancel = cancel
+
+def shard_path(output_dir, video_name):
+    """视频的片段数组分片路径"""
+    return os.path.join(output_dir, "shards", f"{video_name}.npy")
+
+def write_shard_index(output_dir, jobs):
+    """更新分片索引index.csv：每个片段一行，记录所在分片和行号、来源视频、帧范围、行为和裁剪区域。
+    与已有索引合并：jobs中的分片按本次导出重写，其余仍存在的分片保留原有行，已删除分片的行被去掉"""
+    index_path = os.path.join(output_dir, "index.csv")
+    rows = []
+    if os.path.exists(index_path):
+        with open(index_path, 'r', newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))[1:]
+    elif not jobs:
+        return
+    shards = {os.path.relpath(job["shard"], output_dir).replace(os.sep, "/"): job for job in jobs}
+    rows = [row for row in rows if row[0] not in shards and os.path.exists(os.path.join(output_dir, row[0]))]
+    for shard, job in shards.items():
+        for row, clip in enumerate(job["clips"]):
+            rows.append([shard, row, job["video_path"], clip["start"], clip["end"], clip["action"]]
+                        + (clip["selection"] or ["", "", "", ""]))
+    rows.sort(key=lambda row: (row[0], int(row[1])))
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["shard", "row", "video", "start", "end", "action", "x1", "y1", "x2", "y2"])
+        writer.writerows(rows)
+    os.replace(tmp_path, index_path)
+
+def export_video_job(job):
+    """在工作进程中导出一个视频的全部片段，每完成一个片段汇报一次；返回(工作进程号, 解码帧数, 耗时, 完成片段数)，
+    取消后完成片段数可能少于片段总数"""
+    worker = os.getpid()
+    start = time.perf_counter()
+
+    clips_done = 0
+
+    def on_clip_done(clip, decoded):
+        nonlocal clips_done
+        clips_done += 1
+        _export_updates.put((job["video_name"], worker, clips_done, decoded, time.perf_counter() - start,
+                             clip.get("key")))
+
+    shard = None
+    if job.get("shard"):
+        frame_count, width, height = job["array_shape"]
+        shard = ClipShard(job["shard"], len(job["clips"]), frame_count, (width, height))
+    try:
+        decoded = export_video_clips(job["video_path"], job["clips"], job["output_paths"], job["entry"],
+                                     on_clip_done, _export_cancel, shard)
+    except Exception:
+        if shard is not None:
+            shard.discard()
+        raise
+    if shard is not None:
+        # 分片只有全部片段写完才有效
+        if clips_done == len(job["clips"]):
+            shard.close()
+        else:
+            shard.discard()
+    return worker, decoded, time.perf_counter() - start, clips_done
+
+def export_cropped_video(video_dir, txt_dir, output_dir, crop, catalog=None, workers=2, progress=None, cancel=None,
+                         array_shape=None):
+    """用进程池并行导出视频片段，每个视频一个任务，每个视频只顺序解码一遍；
+    progress(状态字典)在调用线程中回调，包含已完成/总记录数、用时、剩余时间和各工作进程的帧率；
+    cancel被设置后停止派发，正在导出的视频写完已开始的片段后停止。给出array_shape=(帧数, 宽, 高)时导出为uint8数组分片
+    和index.csv，供训练直接内存映射读取，不再编码mp4。
+    输出目录中的导出清单使重复导出只生成新增或变化的片段(数组分片以视频为单位)；全部导出成功后，
+    删除本次导出的视频中标记行已移除的片段。返回最终的状态字典，up_to_date为未变化而跳过的记录数"""
+    planned, total_clips, skipped, duplicates, label_lines = plan_export(video_dir, txt_dir, output_dir, crop,
+                                                                         catalog)
+    # 确保输出目录存在
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = ExportManifest(output_dir)
+    options = {"crop": bool(crop), "array_shape": list(array_shape) if array_shape is not None else None}
+    jobs = []
+    completed_jobs = []  # 成功导出或无需重新导出的任务
+    # 没有TXT文件的视频只有在TXT目录与上次导出相同时才视为标记已删除，避免选错目录时删除已导出的片段
+    same_txt_dir = manifest.txt_dir == os.path.abspath(txt_dir)
+    label_lines = {name: lines if lines is not None else set() for name, lines in label_lines.items()
+                   if lines is not None or same_txt_dir}
+    manifest.set_txt_dir(os.path.abspath(txt_dir))
+    outputs = {}  # 键 -> (输出路径, 视频名, 标记行)
+    up_to_date = 0
+    for job in planned:
+        if array_shape is not None:
+            job["shard"] = shard_path(output_dir, job["video_name"])
+            job["array_shape"] = array_shape
+            job["lines"] = [clip["line"] for clip in job["clips"]]
+            job["key"] = ExportManifest.key(job["video_name"], job["lines"], job["entry"], options)
+            if manifest.has(job["key"]):
+                up_to_date += len(job["clips"])
+                completed_jobs.append(job)
+            else:
+                jobs.append(job)
+            continue
+        # mp4逐个片段比对清单，只保留需要重新导出的片段
+        clips = []
+        output_paths = []
+        for clip, output_path in zip(job["clips"], job["output_paths"]):
+            clip["key"] = ExportManifest.key(job["video_name"], clip["line"], job["entry"], options)
+            outputs[clip["key"]] = (output_path, job["video_name"], [clip["line"]])
+            if manifest.has(clip["key"]):
+                up_to_date += 1
+            else:
+                clips.append(clip)
+                output_paths.append(output_path)
+        if clips:
+            job["clips"] = clips
+            job["output_paths"] = output_paths
+            jobs.append(job)
+    skipped += up_to_date
+    status = {"done": skipped, "total": total_clips, "elapsed": 0.0, "remaining": 0.0,
+              "video": "", "workers": {}, "cancelled": False, "up_to_date": up_to_date,
+              "skipped": skipped - up_to_date, "duplicates": duplicates}
+    if not jobs:
+        manifest.remove_orphans(label_lines)
+        if manifest.dirty:
+            manifest.save()
+        write_shard_index(output_dir, completed_jobs)
+        return status
 
-            # 解析框选坐标
-            if len(parts) >= 4 and ',' in parts[3] and crop:
+    start_time = time.time()
+    finished = {}  # 视频名 -> (工作进程号, 完成片段数, 解码帧数, 耗时)
+    running = {}  # 正在导出的视频，结构同上，来自工作进程的进度消息
+
+    def report():
+        status["elapsed"] = elapsed = time.time() - start_time
+        exported = sum(item[1] for item in finished.values()) + sum(item[1] for item in running.values())
+        status["done"] = skipped + exported
+        status["remaining"] = elapsed / exported * (total_clips - status["done"]) if exported else 0.0
+        throughput = {}
+        for worker, _, frames, seconds in list(finished.values()) + list(running.values()):
+            total_frames, total_seconds = throughput.get(worker, (0, 0.0))
+            throughput[worker] = (total_frames + frames, total_seconds + seconds)
+        status["workers"] = {worker: frames / seconds if seconds > 0 else 0.0
+                             for worker, (frames, seconds) in throughput.items()}
+        if progress is not None:
+            progress(status)
+
+    last_save = time.time()
+    failed = 0
+    ctx = multiprocessing.get_context("spawn")
+    updates = ctx.Queue()
+    worker_cancel = ctx.Event()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                               initializer=_init_export_worker, initargs=(updates, worker_cancel))
+    try:
+        # 片段多的视频先派发，减少最后只剩一个进程在忙的时间
+        jobs.sort(key=lambda job: len(job["clips"]), reverse=True)
+        remaining = {pool.submit(export_video_job, job): job for job in jobs}
+        while remaining:
+            if cancel is not None and cancel.is_set() and not status["cancelled"]:
+                status["cancelled"] = True
+                worker_cancel.set()
+                for future in remaining:
+                    future.cancel()
+            done, _ = wait(remaining, timeout=0.2, return_when=FIRST_COMPLETED)
+            while True:
                 try:
-                    coords = list(map(int, parts[3].split(',')))
-                    if coords[0] < coords[2] and coords[1] < coords[3]:
-                        selection = coords
-                except:
-                    pass
+                    update = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if update[5] is not None:
+                    manifest.add(update[5], *outputs[update[5]])
+                if update[0] not in finished:  # 视频已完成后才到达的消息直接忽略
+                    running[update[0]] = update[1:5]
+                    status["video"] = update[0]
+            for future in done:
+                job = remaining.pop(future)
+                running.pop(job["video_name"], None)
+                if future.cancelled():
+                    continue
+                try:
+                    worker, decoded, seconds, clips_done = future.result()
+                except Exception as e:
+                    print(f"导出失败: {e}")
+                    failed += 1
+                    continue
+                finished[job["video_name"]] = (worker, clips_done, decoded, seconds)
+                if clips_done == len(job["clips"]):
+                    completed_jobs.append(job)
+                    if array_shape is not None:
+                        manifest.add(job["key"], job["shard"], job["video_name"], job["lines"])
+            # 定期保存清单，进程意外退出后可从断点继续
+            if manifest.dirty and time.time() - last_save > 2:
+                manifest.save()
+                last_save = time.time()
+            report()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        # 关闭进程池后再取一次，记录最后完成的片段
+        while True:
+            try:
+                update = updates.get_nowait()
+            except queue.Empty:
+                break
+            if update[5] is not None:
+                manifest.add(update[5], *outputs[update[5]])
+        manifest.save()
+    # 全部视频都导出成功后才删除已移除标记的片段
+    if not status["cancelled"] and not failed:
+        manifest.remove_orphans(label_lines)
+        if manifest.dirty:
+            manifest.save()
+    # 导出mp4时completed_jobs中没有分片，只去掉已删除分片的行
+    write_shard_index(output_dir, completed_jobs if array_shape is not None else [])
+    return status
+
+
+def scan_videos(directory, batches, cancel, batch_size=500):
+    ''' 用os.scandir递归扫描视频文件，分批放入队列，扫描结束时放入None '''
+    stack = [directory]
+    batch = []
+    while stack and not cancel.is_set():
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    batch.append(entry.path)
+                    if len(batch) >= batch_size:
+                        batches.put(batch)
+                        batch = []
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))  # 按名称顺序深度优先
+    if batch:
+        batches.put(batch)
+    batches.put(None)
+
+def session_config_grid(dynamic_batch=True):
+    ''' 测速用的默认配置组合：算子内线程数 × batch大小，另加一组算子间并行的配置 '''
+    cpus = os.cpu_count() or 4
+    batch_sizes = [1, 4, 8] if dynamic_batch else [None]
+    configs = [dict(intra_threads=threads, inter_threads=0, parallel=False, optimization_level="extended",
+                    batch_size=batch_size)
+               for threads in sorted({1, max(1, cpus // 2), cpus}) for batch_size in batch_sizes]
+    configs.append(dict(intra_threads=cpus, inter_threads=2, parallel=True, optimization_level="all",
+                        batch_size=batch_sizes[-1]))
+    return configs
+
+def format_session_config(config):
+    ''' 推理配置的简短描述，线程数为0表示自动 '''
+    return (f"算子内线程={config['intra_threads'] or '自动'} 算子间线程={config['inter_threads'] or '自动'} "
+            f"{'并行' if config['parallel'] else '顺序'} 优化={config['optimization_level']} "
+            f"batch={config['batch_size'] or '模型固定'}")
+
+def benchmark_session_configs(model_path, configs, frame_count=32, frame_size=(720, 1280), report=None, cancel=None):
+    ''' 在本机上逐个配置测量骨骼推理吞吐量(帧/秒，含预处理和后处理)；
+    report(配置, 帧/秒)逐条回调，返回[(配置, 帧/秒)]，会话创建失败时帧/秒为0 '''
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, frame_size + (3,), dtype=np.uint8) for _ in range(4)]
+    results = []
+    for config in configs:
+        if cancel is not None and cancel.is_set():
+            break
+        settings = dict(config)
+        batch_size = settings.pop("batch_size")
+        fps = 0.0
+        session = initialize_session(model_path, **settings)
+        if session is not None:
+            batcher = SkeletonBatcher(SkeletonSession(session), batch_size or 1)
+            # 预热一个batch，不计入耗时
+            for i in range(batcher.batch_size):
+                batcher.add(i, frames[i % len(frames)])
+            start = time.perf_counter()
+            for i in range(frame_count):
+                batcher.add(i, frames[i % len(frames)])
+            batcher.flush()
+            fps = frame_count / max(time.perf_counter() - start, 1e-6)
+        results.append((config, fps))
+        if report is not None:
+            report(config, fps)
+    return results
+
+def sample_video_frames(video_paths, count, offset=0.0, catalog=None):
+    ''' 均匀选取共约count个(视频路径, 帧号)：视频多于count个时先在列表中均匀选出count个视频，每个取一帧，
+    否则把count帧尽量平均分给各视频；只读取选中视频的帧数，catalog中有元数据时直接使用。
+    offset为采样间隔内的相对偏移，取不同值可得到互不重叠的采样 '''
+    samples = []
+    if not video_paths or count <= 0:
+        return samples
+    if len(video_paths) > count:
+        chosen = [video_paths[int((i + offset) * len(video_paths) / count)] for i in range(count)]
+    else:
+        chosen = list(video_paths)
+    for i, video_path in enumerate(chosen):
+        per_video = count // len(chosen) + (1 if i < count % len(chosen) else 0)
+        entry = catalog.get(video_path) if catalog is not None else None
+        if entry is not None:
+            total = entry["frames"]
+        else:
+            cap = cv2.VideoCapture(video_path)
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+        if total <= 0:
+            continue
+        # 各视频的采样相位按黄金比例错开，避免每个视频都只取到开头的帧
+        phase = (i * 0.6180339887 + offset) % 1.0
+        step = total / per_video
+        samples.extend((video_path, min(total - 1, int((j + phase) * step))) for j in range(per_video))
+    return samples
+
+class CalibrationFrameReader:
+    ''' INT8量化的校准数据：按需解码采样帧并预处理为模型输入，供onnxruntime量化工具逐个读取 '''
+    def __init__(self, samples, input_name, input_size=SKELETON_INPUT_SIZE, progress=None):
+        self.samples = list(samples)
+        self.input_name = input_name
+        self.preprocessor = LetterboxPreprocessor(input_size)
+        self.progress = progress  # progress(已读取帧数, 总帧数)
+        self.position = 0
+        self.cap = None
+        self.cap_path = None
+
+    def read_frame(self, video_path, index):
+        ''' 解码指定帧，同一视频的连续采样复用同一个VideoCapture；失败时返回None '''
+        if self.cap_path != video_path:
+            self.close()
+            self.cap = cv2.VideoCapture(video_path)
+            self.cap_path = video_path
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = self.cap.read()
+        return frame if ret else None
 
-            # 写入视频片段
-            output_folder = os.path.join(output_dir, action)
-            os.makedirs(output_folder, exist_ok=True)
-            output_name = (
-                f"{video_name}_{start_frame}_{end_frame}_{action}"
-                f"{f'_{selection[0]}_{selection[1]}_{selection[2]}_{selection[3]}' if selection else ''}.mp4"
-            )
-            output_path = os.path.join(output_folder, output_name)
-
-            # 配置视频写入器
-            width = (selection[2] - selection[0]) if selection else int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = (selection[3] - selection[1]) if selection else int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            out = cv2.VideoWriter(
-                output_path,
-                cv2.VideoWriter_fourcc(*'mp4v'),
-                cap.get(cv2.CAP_PROP_FPS),
-                (width, height)
-            )
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+        self.cap = None
+        self.cap_path = None
+
+    def get_next(self):
+        while self.position < len(self.samples):
+            frame = self.read_frame(*self.samples[self.position])
+            self.position += 1
+            if self.progress is not None:
+                self.progress(self.position, len(self.samples))
+            if frame is not None:
+                # 预处理结果写在复用的缓冲区里，交给量化工具前复制一份
+                return {self.input_name: self.preprocessor(frame).copy()}
+        self.close()
+        return None
 
-            # 提取并写入帧
-            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-            for _ in range(start_frame, end_frame + 1):
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                if selection:
-                    frame = frame[selection[1]:selection[3], selection[0]:selection[2]]
-                out.write(frame)
-            out.release()
+def quantize_pose_model(model_path, output_path, video_paths, calibration_frames=64, progress=None, catalog=None):
+    ''' 用视频中的采样帧做校准，生成静态量化的INT8模型(QDQ格式，权重按通道量化)，全程离线 '''
+    try:
+        from onnxruntime.quantization import quantize_static, QuantFormat, QuantType, CalibrationMethod
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError as e:
+        raise RuntimeError(f"INT8量化需要安装onnx: {e}")
+    ort_session = initialize_session(model_path)
+    if ort_session is None:
+        raise RuntimeError("模型加载失败")
+    samples = sample_video_frames(video_paths, calibration_frames, catalog=catalog)
+    if not samples:
+        raise RuntimeError("没有可用于校准的视频帧")
+    reader = CalibrationFrameReader(samples, ort_session.get_inputs()[0].name, model_input_size(ort_session),
+                                    progress)
+    # 量化前先做形状推断和图优化(跳过依赖sympy的符号形状推断)，失败时直接量化原模型
+    model_input = model_path
+    prepared_path = output_path + ".prep.onnx"
+    try:
+        quant_pre_process(model_path, prepared_path, skip_symbolic_shape=True)
+        model_input = prepared_path
+    except Exception as e:
+        print(f"量化预处理失败，直接量化原模型: {e}")
+    try:
+        quantize_static(model_input, output_path, reader, quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True,
+                        calibrate_method=CalibrationMethod.MinMax)
+    finally:
+        if os.path.exists(prepared_path):
+            os.remove(prepared_path)
+    return output_path
+
+def compare_pose_models(reference_path, candidate_path, video_paths, frame_count=32, session_settings=None,
+                        catalog=None):
+    ''' 在采样帧上对比两个骨骼模型：平均每帧耗时(含预处理和后处理)和最高分目标的关键点偏差(像素)，
+    只统计参考模型中置信度大于0.5的关键点；采样帧与量化校准帧错开 '''
+    samples = sample_video_frames(video_paths, frame_count, offset=0.5, catalog=catalog)
+    sessions = []
+    for path in [reference_path, candidate_path]:
+        ort_session = initialize_session(path, **(session_settings or {}))
+        if ort_session is None:
+            raise RuntimeError(f"模型加载失败: {path}")
+        ort_session = SkeletonSession(ort_session)
+        ort_session.warmup()
+        sessions.append((ort_session, LetterboxPreprocessor(ort_session.input_size)))
+    elapsed = [0.0, 0.0]
+    deviations = []
+    frames = matched = 0
+    reader = CalibrationFrameReader(samples, sessions[0][0].input_name)
+    for video_path, index in samples:
+        frame = reader.read_frame(video_path, index)
+        if frame is None:
+            continue
+        frames += 1
+        results = []
+        for i, (ort_session, preprocessor) in enumerate(sessions):
+            start = time.perf_counter()
+            results.append(detect_skeleton(ort_session, frame, 0.1, preprocessor))
+            elapsed[i] += time.perf_counter() - start
+        reference, candidate = results
+        if reference is None or candidate is None:
+            matched += reference is None and candidate is None
+            continue
+        matched += 1
+        ref_kpts = reference[2][reference[1].argmax()].reshape(-1, 3)
+        cand_kpts = candidate[2][candidate[1].argmax()].reshape(-1, 3)
+        visible = ref_kpts[:, 2] > 0.5
+        deviations.extend(np.linalg.norm(ref_kpts[visible, :2] - cand_kpts[visible, :2], axis=1).tolist())
+    reader.close()
+    return {
+        "frames": frames,
+        "reference_ms": elapsed[0] / max(frames, 1) * 1000,
+        "candidate_ms": elapsed[1] / max(frames, 1) * 1000,
+        "mean_deviation": float(np.mean(deviations)) if deviations else 0.0,
+        "max_deviation": float(np.max(deviations)) if deviations else 0.0,
+        "detection_agreement": matched / max(frames, 1),  # 两个模型都有或都没有检测结果的帧的比例
+    }
+
+def format_model_comparison(report):
+    return (f"对比帧数: {report['frames']}\n"
+            f"FP32: {report['reference_ms']:.1f} ms/帧\n"
+            f"INT8: {report['candidate_ms']:.1f} ms/帧 "
+            f"(加速 {report['reference_ms'] / max(report['candidate_ms'], 1e-6):.2f}倍)\n"
+            f"关键点偏差: 平均 {report['mean_deviation']:.2f} 像素，最大 {report['max_deviation']:.2f} 像素\n"
+            f"检测一致率: {report['detection_agreement'] * 100:.1f}%")
+
+def list_videos(directory):
+    ''' 同步递归列出目录下的全部视频文件 '''
+    batches = queue.Queue()
+    scan_videos(directory, batches, threading.Event())
+    video_paths = []
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return video_paths
+        video_paths.extend(batch)
+
+_keypoint_session = None  # 批量关键点计算时每个工作进程各自的ONNX会话
+_keypoint_cancel = None
+
+def _init_keypoint_worker(model_path, session_settings, cancel=None):
+    global _keypoint_session, _keypoint_cancel
+    _keypoint_cancel = cancel
+    session = initialize_session(model_path, **session_settings)
+    if session is not None:
+        _keypoint_session = SkeletonSession(session)
+        _keypoint_session.warmup()
+
+def keypoint_output_paths(video_dir, video_path, output_dir):
+    ''' 批量关键点的输出文件，按视频在目录中的相对路径存放 '''
+    base = os.path.join(output_dir, os.path.splitext(os.path.relpath(video_path, video_dir))[0])
+    return base + ".npz", base + ".csv"
+
+def keypoints_up_to_date(npz_path, video_path, model_hash, stride):
+    ''' 已有输出且视频、模型和抽帧间隔都未变化时返回True，用于断点续算 '''
+    try:
+        with np.load(npz_path) as data:
+            return (str(data["model_hash"]) == model_hash and int(data["stride"]) == stride
+                    and str(data["video_key"]) == video_cache_key(video_path))
+    except Exception:
+        return False
 
-        cap.release()
+def compute_video_keypoints(video_path, npz_path, csv_path, model_hash, stride, conf_threshold, batch_size=8):
+    ''' 在工作进程中对视频每stride帧推理一次，写出关键点数组和CSV，返回(视频路径, 推理帧数)；
+    取消时不写出结果，推理帧数为None '''
+    if _keypoint_session is None:
+        raise RuntimeError("模型加载失败")
+    frames = []
+    detections = []
+    batcher = SkeletonBatcher(_keypoint_session, batch_size, conf_threshold)
+
+    def collect(results):
+        for index, result in results:
+            frames.append(index)
+            detections.append(result if result is not None else KeypointCache.empty())
+
+    cap = cv2.VideoCapture(video_path)
+    index = 0
+    while True:
+        if _keypoint_cancel is not None and _keypoint_cancel.is_set():
+            cap.release()
+            return video_path, None
+        # 不需要推理的帧只grab不解码
+        if index % stride == 0:
+            ret, frame = cap.read()
+        else:
+            ret, frame = cap.grab(), None
+        if not ret:
+            break
+        if frame is not None:
+            collect(batcher.add(index, frame))
+        index += 1
+    cap.release()
+    collect(batcher.flush())
+
+    os.makedirs(os.path.dirname(npz_path), exist_ok=True)
+    num_kpts = max((d[2].shape[1] // 3 for d in detections if len(d[1]) > 0), default=17)
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        header = ["frame", "person", "x1", "y1", "x2", "y2", "score"]
+        for kid in range(num_kpts):
+            header += [f"kpt{kid}_x", f"kpt{kid}_y", f"kpt{kid}_conf"]
+        writer.writerow(header)
+        for index, (boxes, scores, kpts) in zip(frames, detections):
+            for person in range(len(scores)):
+                writer.writerow([index, person] + [f"{v:.2f}" for v in boxes[person]] + [f"{scores[person]:.4f}"]
+                                + [f"{v:.2f}" for v in kpts[person]])
+    os.replace(tmp_path, csv_path)
+    # npz最后写入，它的存在即表示该视频已完成
+    tmp_path = npz_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, model_hash=model_hash, stride=stride, video_key=video_cache_key(video_path),
+                 **pack_detections(frames, detections))
+    os.replace(tmp_path, npz_path)
+    return video_path, len(frames)
+
+def precompute_keypoints(video_dir, model_path, output_dir, stride=1, workers=2, threads_per_worker=2,
+                         batch_size=8, session_settings=None, conf_threshold=0.1, progress=None, cancel=None):
+    ''' 用进程池批量计算目录下所有视频的骨骼关键点，已完成的视频自动跳过；session_settings为
+    initialize_session的其余参数，算子内线程数由threads_per_worker决定；
+    progress(已处理视频数, 视频总数, 推理帧数, 帧/秒)回调进度，返回(完成数, 跳过数, 失败数, 帧/秒) '''
+    model_hash = model_file_hash(model_path)
+    video_paths = list_videos(video_dir)
+    jobs = []
+    for video_path in video_paths:
+        npz_path, csv_path = keypoint_output_paths(video_dir, video_path, output_dir)
+        if not keypoints_up_to_date(npz_path, video_path, model_hash, stride):
+            jobs.append((video_path, npz_path, csv_path))
+    skipped = len(video_paths) - len(jobs)
+    done = failed = frame_count = 0
+    fps = 0.0
+    if progress is not None:
+        progress(skipped, len(video_paths), 0, fps)
+
+    session_settings = dict(session_settings or {}, intra_threads=threads_per_worker)
+    start = time.perf_counter()
+    # 用spawn启动工作进程，避免fork时继承界面线程持有的锁
+    ctx = multiprocessing.get_context("spawn")
+    worker_cancel = ctx.Event()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_keypoint_worker,
+                               initargs=(model_path, session_settings, worker_cancel))
+    try:
+        remaining = {pool.submit(compute_video_keypoints, video_path, npz_path, csv_path,
+                                 model_hash, stride, conf_threshold, batch_size)
+                     for video_path, npz_path, csv_path in jobs}
+        while remaining:
+            if cancel is not None and cancel.is_set():
+                # 工作进程在帧之间检查取消标志，正在计算的视频不写出结果
+                worker_cancel.set()
+                break
+            finished, remaining = wait(remaining, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    video_path, count = future.result()
+                    if count is None:
+                        continue
+                    frame_count += count
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"关键点计算失败: {e}")
+            if finished:
+                fps = frame_count / max(time.perf_counter() - start, 1e-6)
+                if progress is not None:
+                    progress(skipped + done + failed, len(video_paths), frame_count, fps)
+    finally:
+        # 不等待正在计算的视频，取消后立即返回
+        pool.shutdown(wait=False, cancel_futures=True)
+    return done, skipped, failed, fps
+
+class VirtualListbox(tk.Frame):
+    ''' 只为可见行创建画布项的虚拟列表，行数再多也不会拖慢界面 '''
+    def __init__(self, master, on_select=None, row_height=18, font=("Arial", 10)):
+        super().__init__(master)
+        self.on_select = on_select
+        self.row_height = row_height
+        self.font = font
+        self.rows = []  # 第i行对应的数据索引，升序
+        self.text_of = lambda index: ""
+        self.top = 0  # 第一个可见行
+        self.selected = None  # 选中的数据索引
+        self.row_items = []  # 可见行复用的(背景, 文本)画布项
+
+        self.canvas = tk.Canvas(self, bg='white', highlightthickness=0, width=150)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.canvas.bind('<Configure>', self._on_configure)
+        self.canvas.bind('<Button-1>', self._on_click)
+        self.canvas.bind('<MouseWheel>', lambda e: self.scroll(-1 if e.delta > 0 else 1, 'units'))
+        self.canvas.bind('<Button-4>', lambda e: self.scroll(-1, 'units'))
+        self.canvas.bind('<Button-5>', lambda e: self.scroll(1, 'units'))
+
+    def set_rows(self, rows, text_of=None):
+        ''' 设置要显示的数据索引列表 '''
+        self.rows = rows
+        if text_of is not None:
+            self.text_of = text_of
+        self.top = max(0, min(self.top, self._max_top()))
+        self.refresh()
+
+    def row_of(self, index):
+        ''' 数据索引所在的行，不在列表中时返回None '''
+        row = bisect.bisect_left(self.rows, index)
+        if row < len(self.rows) and self.rows[row] == index:
+            return row
+        return None
 
-    # 最终状态
-    elapsed = time.time() - start_time
-    status_label.config(
-        text=f"完成！处理 {total_clips} 条记录 | 总用时: {time.strftime('%H:%M:%S', time.gmtime(elapsed))}"
-    )
-    return True
+    def select(self, index):
+        self.selected = index
+        self.see(index)
 
+    def see(self, index):
+        ''' 滚动使数据索引可见 '''
+        row = self.row_of(index)
+        if row is None:
+            self.refresh()
+            return
+        visible = self._visible_count()
+        if row < self.top:
+            self.top = row
+        elif row >= self.top + visible - 1:
+            self.top = min(self._max_top(), row - visible + 2)
+        self.refresh()
+
+    def yview(self, *args):
+        ''' 滚动条回调 '''
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.rows))
+            self.top = max(0, min(self.top, self._max_top()))
+            self.refresh()
+        elif args[0] == 'scroll':
+            self.scroll(int(args[1]), args[2])
+
+    def scroll(self, amount, what):
+        step = amount * (self._visible_count() - 1) if what == 'pages' else amount * 3
+        self.top = max(0, min(self.top + step, self._max_top()))
+        self.refresh()
+
+    def refresh(self):
+        ''' 只重绘可见行 '''
+        width = self.canvas.winfo_width()
+        for i, (background, text) in enumerate(self.row_items):
+            row = self.top + i
+            if row < len(self.rows):
+                index = self.rows[row]
+                selected = index == self.selected
+                self.canvas.coords(background, 0, i * self.row_height, width, (i + 1) * self.row_height)
+                self.canvas.itemconfig(background, fill='#0078d7' if selected else 'white', state=tk.NORMAL)
+                self.canvas.itemconfig(text, text=self.text_of(index),
+                                       fill='white' if selected else 'black', state=tk.NORMAL)
+            else:
+                self.canvas.itemconfig(background, state=tk.HIDDEN)
+                self.canvas.itemconfig(text, state=tk.HIDDEN)
+        if self.rows:
+            first = self.top / len(self.rows)
+            last = min(1.0, (self.top + self._visible_count()) / len(self.rows))
+            self.scrollbar.set(first, last)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _visible_count(self):
+        return max(1, self.canvas.winfo_height() // self.row_height + 1)
+
+    def _max_top(self):
+        return max(0, len(self.rows) - self._visible_count() + 1)
+
+    def _on_configure(self, event):
+        # 窗口变高时补充可复用的行画布项
+        while len(self.row_items) < self._visible_count():
+            i = len(self.row_items)
+            background = self.canvas.create_rectangle(0, 0, 0, 0, outline='', state=tk.HIDDEN)
+            text = self.canvas.create_text(4, i * self.row_height + self.row_height // 2,
+                                           anchor=tk.W, font=self.font, state=tk.HIDDEN)
+            self.row_items.append((background, text))
+        self.top = max(0, min(self.top, self._max_top()))
+        self.refresh()
+
+    def _on_click(self, event):
+        row = self.top + event.y // self.row_height
+        if row < len(self.rows):
+            self.selected = self.rows[row]
+            self.refresh()
+            if self.on_select is not None:
+                self.on_select(self.selected)
 
 class BehaviLabel:
+    PROXY_WINDOW = 5  # 代理只为当前视频前后各这么多个视频生成
+
     def __init__(self, root,mode):
         self.version = '1.0.3'
         self.root = root
         self.label_file = None
         self.labels = []
         self.video_dir = None
+        self.catalog = None  # 当前视频目录的元数据目录
         self.video_index = 0
         self.video_list = []
+        self.video_subfolders = []  # 与video_list对应的子目录(相对视频目录)
+        self.subfolders = set()
+        self.video_rows = []  # 经过筛选后显示在列表中的视频索引
+        self.labeled_names = set()  # 已有标注记录的视频名
+        self.video_names = set()  # 列表中的视频名，用于发现同名视频
+        self.duplicate_videos = []  # 因同名被忽略的视频
+        self.scan_batches = None  # 当前目录扫描的结果队列
+        self.scan_cancel = None
         self.save_dir = None
         self.start_frame = None
         self.end_frame = None
         self.mode = mode
-        self.cap = None
+        # 固定视频显示区域尺寸
+        self.display_width = 1000  # 固定宽度
+        self.display_height = 600  # 固定高度
+        self.frame_cache_mb = 512  # 解码帧缓存预算(MB)
+        self.frame_cache_mb_var = tk.IntVar(value=self.frame_cache_mb)
+        self.frame_cache = FrameCache(self.frame_cache_mb * 1024 * 1024)
+        self.video_indexer = VideoIndexer()
+        self.use_proxy = False  # 是否从低分辨率代理播放
+        self.use_proxy_var = tk.BooleanVar(value=self.use_proxy)
+        self.proxy_manager = ProxyManager(self.display_width, self.display_height)
+        self.thumbnail_generator = ThumbnailGenerator()
+        self.filmstrip_count = 10  # 胶片条上显示的缩略图数量
+        self.filmstrip_height = 56
+        self.filmstrip_video = None  # 胶片条当前显示的视频路径
+        self.filmstrip_requested = None
+        self.filmstrip_photos = []
+        self.dragging = False
+        self.preloader = VideoPreloader(frame_cache=self.frame_cache, indexer=self.video_indexer,
+                                        proxy_manager=self.proxy_manager)
+        self.prefetcher = FramePrefetcher(self.process_frame, frame_cache=self.frame_cache,
+                                          indexer=self.video_indexer, proxy_manager=self.proxy_manager,
+                                          preloader=self.preloader)
+        # 环形缓冲区数量 = 队列容量 + 等待入队/正在显示/正在写入各一帧
+        self.frame_scaler = FrameScaler(self.display_width, self.display_height,
+                                        buffer_count=self.prefetcher.frames.maxsize + 3)
+        self.displayed_frame = None  # 画布上当前显示的(视频路径, 帧号)
+        self.video_fps = 0.0
+        self.playback_clock = PlaybackClock()
+        self.next_item = None  # 播放时已从队列取出但还未到显示时刻的帧
+        self.dropped_frames = 0
+        self.last_fps_refresh = 0.0
         self.paused = True
         self.allowed_speed = [1,2,3,4,8,16]
         self.speed_index = 0
@@ -325,16 +2528,29 @@ class BehaviLabel:
         self.model_loaded = False
         self.model_load_failed = False
         self.loading_message = None
+        self.model_path = None
+        # 推理会话设置，线程数为0表示由ONNX Runtime决定
+        self.session_settings = {"intra_threads": 0, "inter_threads": 0, "parallel": False,
+                                 "optimization_level": "extended"}
+        self.inference_batch_size = 8  # 批量计算关键点时每次推理的帧数
+        self.model_hash = None  # 当前模型文件的哈希，关键点缓存以此区分模型
+        self.keypoint_cache = KeypointCache()
+        self.skeleton_worker = SkeletonWorker(keypoint_cache=self.keypoint_cache)
+        self.skeleton_tracking_var = tk.BooleanVar(value=self.skeleton_worker.tracking)
+        self.skeleton_result_id = 0  # 当前画面已合成的骨骼推理结果编号
+        self.displayed_image = None  # 当前显示帧(缩放后、未叠加骨骼)
+        self.displayed_source = None  # 当前显示帧对应的原始解码帧
+        self.skeleton_layer = None  # 缓存的骨骼图层(推理结果, 显示尺寸, 非透明像素)
 
         self.selecting = False
         self.selection_start = None
         self.selection_end = None
-        self.selection_rect = None
+        self.selection_rect = None  # 常驻的选择框画布项
         self.enable_selection = False  # 是否启用框选模式
+        self.show_timeline = True  # 是否在画面底部显示标注时间轴
+        self.show_timeline_var = tk.BooleanVar(value=self.show_timeline)
+        self.timeline_total = 0  # 时间轴上标注段按此总帧数绘制
 
-        # 固定视频显示区域尺寸
-        self.display_width = 1000  # 固定宽度
-        self.display_height = 600  # 固定高度
         self.setup_ui()
         # 修改绑定方式，使用bind_all确保全局捕获空格键
         self.root.bind_all('<space>', self.toggle_pause_continue)
@@ -348,6 +2564,7 @@ class BehaviLabel:
         self.root.bind_all('<Left>', self.last_frame)
         self.root.bind_all('<Right>', self.next_frame)
         self.root.bind_all('<r>', self.toggle_draw_skeleton)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.update()
 
     def update_working_time(self):
@@ -362,6 +2579,9 @@ class BehaviLabel:
         self.lb_draw_skeleton = tk.Label(filename_frame, text="骨骼绘制未启用", font=("Arial", 10),fg="red")
         self.lb_draw_skeleton.pack(side=tk.LEFT,padx=5)
 
+        self.lb_fps = tk.Label(filename_frame, text="", font=("Arial", 10))
+        self.lb_fps.pack(side=tk.LEFT, padx=5)
+
         self.lb_time = tk.Label(filename_frame, text="", font=("Arial", 10))
         self.lb_time.pack(side=tk.RIGHT, padx=5)
 
@@ -423,6 +2643,19 @@ class BehaviLabel:
         self.setting_menu = tk.Menu(self.root, tearoff=0)
         self.setting_menu.add_checkbutton(label="连续播放", command=self.toggle_auto_playing,variable=self.auto_playing_var)
         self.setting_menu.add_checkbutton(label="启用框选模式", command=self.toggle_selection_mode)
+        self.setting_menu.add_checkbutton(label="显示标注时间轴", command=self.toggle_timeline,
+                                          variable=self.show_timeline_var)
+        self.cache_menu = tk.Menu(self.setting_menu, tearoff=0)
+        for size_mb in [256, 512, 1024, 2048, 4096]:
+            self.cache_menu.add_radiobutton(label=f"{size_mb}MB", value=size_mb,
+                                            variable=self.frame_cache_mb_var,
+                                            command=self.change_frame_cache_size)
+        self.setting_menu.add_cascade(label="帧缓存大小", menu=self.cache_menu)
+        self.setting_menu.add_checkbutton(label="使用低分辨率代理", command=self.toggle_use_proxy,
+                                          variable=self.use_proxy_var)
+        self.setting_menu.add_command(label="推理设置", command=self.inference_settings)
+        self.setting_menu.add_checkbutton(label="骨骼ROI跟踪", command=self.toggle_skeleton_tracking,
+                                          variable=self.skeleton_tracking_var)
         # 关于菜单
         self.btn_util = tk.Button(button_frame, text="工具 ▼",
                                    command=lambda: self.show_menu(self.util_menu, self.btn_util))
@@ -430,9 +2663,11 @@ class BehaviLabel:
         self.util_menu = tk.Menu(self.root, tearoff=0)
         self.util_menu.add_command(label="视频分片", command=self.export)
         self.util_menu.add_command(label="标记统计", command=self.show_statistics)
+        self.util_menu.add_command(label="批量计算关键点", command=self.precompute_keypoints)
         self.util_menu.add_separator()
         self.util_menu.add_command(label="加载骨骼模型", command=self.load_model_async)
         self.util_menu.add_command(label="启用/关闭骨骼检测(R)", command=self.toggle_draw_skeleton)
+        self.util_menu.add_command(label="生成INT8量化模型", command=self.quantize_model)
 
 
         #关于菜单
@@ -458,6 +2693,33 @@ class BehaviLabel:
                                       highlightthickness=0)
         self.video_canvas.pack(side=tk.TOP, pady=10, padx=10)
 
+        # 常驻画布项：逐帧只修改内容和坐标，不再删除重建
+        self.image_item = self.video_canvas.create_image(0, 0, anchor=tk.NW)
+        self.selection_rect = self.video_canvas.create_rectangle(
+            0, 0, 0, 0, outline='red', width=2, dash=(5, 5), state=tk.HIDDEN)
+        timeline_y = self.display_height - 6
+        self.timeline_bg = self.video_canvas.create_rectangle(
+            0, timeline_y, self.display_width, self.display_height,
+            fill='#404040', outline='', state=tk.HIDDEN)
+        self.timeline_cursor = self.video_canvas.create_line(
+            0, timeline_y - 2, 0, self.display_height, fill='white', width=2, state=tk.HIDDEN)
+
+        # 胶片条：均匀分布的缩略图，后台生成后显示
+        self.filmstrip_canvas = tk.Canvas(left_frame,
+                                          width=self.display_width,
+                                          height=self.filmstrip_height,
+                                          bg='#202020',
+                                          highlightthickness=0)
+        self.filmstrip_canvas.pack(side=tk.TOP, padx=10)
+        slot_width = self.display_width // self.filmstrip_count
+        self.filmstrip_items = [
+            self.filmstrip_canvas.create_image(i * slot_width + slot_width // 2, self.filmstrip_height // 2)
+            for i in range(self.filmstrip_count)
+        ]
+        self.filmstrip_marker = self.filmstrip_canvas.create_rectangle(
+            0, 0, 0, 0, outline='yellow', width=2, state=tk.HIDDEN)
+        self.filmstrip_canvas.bind("<Button-1>", self.on_filmstrip_click)
+
         # 进度条
         progress_frame = tk.Frame(left_frame)
         progress_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
@@ -469,6 +2731,7 @@ class BehaviLabel:
         self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
         self.progress.bind("<B1-Motion>", self.on_progress_drag)  # 拖动
+        self.progress.bind("<ButtonRelease-1>", self.on_progress_release)  # 松开时才精确解码
 
         # 右上空白区域 - 现在添加帧信息和行为选择
         right_top_frame = tk.Frame(right_frame, bg='#f0f0f0')
@@ -511,12 +2774,21 @@ class BehaviLabel:
 
         self.lb_video_list = (tk.Label(video_list_frame, text="未设置视频目录"))
         self.lb_video_list.pack(side=tk.TOP)
-        self.video_listbox = tk.Listbox(video_list_frame)
-        self.video_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
-        video_scrollbar = tk.Scrollbar(video_list_frame, orient=tk.VERTICAL, command=self.video_listbox.yview)
-        video_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.video_listbox.config(yscrollcommand=video_scrollbar.set)
+        # 视频列表筛选：按子目录、仅未标注
+        filter_frame = tk.Frame(video_list_frame)
+        filter_frame.pack(side=tk.TOP, fill=tk.X)
+        self.subfolder_var = tk.StringVar(value="全部")
+        self.subfolder_combobox = ttk.Combobox(filter_frame, textvariable=self.subfolder_var,
+                                               state="readonly", width=10, values=["全部"])
+        self.subfolder_combobox.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.subfolder_combobox.bind('<<ComboboxSelected>>', self.apply_video_filter)
+        self.unlabeled_only_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(filter_frame, text="仅未标注", variable=self.unlabeled_only_var,
+                       command=self.apply_video_filter).pack(side=tk.LEFT)
+
+        self.video_list_view = VirtualListbox(video_list_frame, on_select=self.on_video_select)
+        self.video_list_view.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         # 标注记录列表框架
         annotation_frame = tk.Frame(bottom_frame)
@@ -533,8 +2805,6 @@ class BehaviLabel:
 
         self.annotation_listbox.bind('<Button-3>', self.operate_record)  # 右键点击
 
-        self.video_listbox.bind('<<ListboxSelect>>', self.on_video_select)
-        self.video_listbox.bind('<FocusIn>', lambda e: self.root.focus_set())
 
     def toggle_selection_mode(self):
         """切换框选模式"""
@@ -585,15 +2855,51 @@ class BehaviLabel:
         else:
             self.draw_selection_rect()
 
+    def selection_to_video_coords(self):
+        """把画布上的框选区域转换为视频原始坐标(x1, y1, x2, y2)，没有有效框选时返回None"""
+        if self.selection_start and self.selection_end and self.video_width and self.video_height:
+            # 转换为视频原始坐标
+            display_width = self.video_canvas.winfo_width()
+            display_height = self.video_canvas.winfo_height()
+
+            # 计算缩放比例
+            ratio = min(display_width / self.video_width,
+                        display_height / self.video_height)
+            new_width = int(self.video_width * ratio)
+            new_height = int(self.video_height * ratio)
+
+            # 计算偏移量
+            x_offset = (display_width - new_width) // 2
+            y_offset = (display_height - new_height) // 2
+
+            # 转换坐标
+            x1 = max(0, min(self.selection_start[0], self.selection_end[0]))
+            y1 = max(0, min(self.selection_start[1], self.selection_end[1]))
+            x2 = min(new_width, max(self.selection_start[0], self.selection_end[0]))
+            y2 = min(new_height, max(self.selection_start[1], self.selection_end[1]))
+
+            # 转换为原始视频坐标
+            x1 = int((x1 - x_offset) / ratio)
+            y1 = int((y1 - y_offset) / ratio)
+            x2 = int((x2 - x_offset) / ratio)
+            y2 = int((y2 - y_offset) / ratio)
+
+            # 确保坐标在视频范围内
+            x1 = max(0, min(x1, self.video_width - 1))
+            y1 = max(0, min(y1, self.video_height - 1))
+            x2 = max(0, min(x2, self.video_width - 1))
+            y2 = max(0, min(y2, self.video_height - 1))
+
+            # 确保x2 > x1且y2 > y1
+            if x2 > x1 and y2 > y1:
+                return x1, y1, x2, y2
+        return None
+
     def clear_selection(self):
         """清除当前选择"""
-        if self.selection_rect:
-            self.video_canvas.delete(self.selection_rect)
-            self.selection_rect = None
+        self.video_canvas.itemconfig(self.selection_rect, state=tk.HIDDEN)
         self.selection_start = None
         self.selection_end = None
-        # 确保选择框从画布上完全移除
-        self.video_canvas.delete("selection_rect")
 
     def operate_record(self, event):
         """右键点击标注记录时弹出提示框"""
@@ -661,6 +2967,7 @@ class BehaviLabel:
                 self.selection_start = (x1, y1)
                 self.selection_end = (x2, y2)
                 self.enable_selection = True
+                self.draw_selection_rect()
             else:
                 # 如果没有选择框坐标，清除当前选择
                 self.clear_selection()
@@ -732,11 +3039,81 @@ class BehaviLabel:
             menu.grab_release()
 
     def update(self):
-        if len(self.video_list) > 0 and not self.paused:
-            self.show_frame(self.video_list[self.video_index])
-            self.update_progress()
+        delay = self.delay
+        if len(self.video_list) > 0:
+            self.sync_playback()
+            # 主线程只负责显示后台线程已经处理好的帧
+            self.update_filmstrip()
+            if self.paused:
+                item = self.prefetcher.get()
+                if item is not None:
+                    self.display_frame(item)
+            else:
+                delay = self.play_tick()
+            # 骨骼推理结果晚于画面到达时，在当前帧上重新合成
+            if self.draw_skeleton and self.skeleton_worker.result_id != self.skeleton_result_id:
+                self.composite_frame()
         self.update_working_time()
-        self.root.after(self.delay, self.update)
+        self.root.after(delay, self.update)
+
+    def play_tick(self):
+        """按播放时钟显示到期的帧，落后时丢弃过期帧；返回距下一帧到期的毫秒数"""
+        clock = self.playback_clock
+        step = self.allowed_speed[self.speed_index]
+        now = time.perf_counter()
+        item = None
+        while True:
+            if self.next_item is not None and self.next_item['generation'] != self.prefetcher.generation:
+                self.next_item = None
+            if self.next_item is None:
+                self.next_item = self.prefetcher.get()
+                if self.next_item is None:
+                    break
+                # 新视频的首帧才知道真实帧率，以它为起点重新计时
+                if self.next_item['fps'] != clock.fps and self.next_item['fps'] > 0:
+                    clock.reset(self.next_item['index'], self.next_item['fps'], step)
+                    now = clock.start_time
+            if self.next_item['image'] is not None and self.next_item['index'] > clock.target_frame(now):
+                break  # 还没到显示时刻
+            if item is not None and item['image'] is not None:
+                self.dropped_frames += 1
+            item, self.next_item = self.next_item, None
+            if item['image'] is None:
+                break
+
+        if item is not None:
+            self.display_frame(item)
+            clock.mark_displayed(now)
+        elif self.next_item is None:
+            # 解码跟不上且落后超过1秒时，直接跳到目标帧继续解码
+            target = clock.target_frame(now)
+            if target - self.current_frame > clock.fps * step:
+                self.dropped_frames += (target - self.current_frame) // step
+                self.prefetcher.request(self.video_list[self.video_index], target, step, playing=True)
+
+        if now - self.last_fps_refresh > 0.5:
+            self.last_fps_refresh = now
+            self.lb_fps.config(text=f"帧率: {clock.achieved_fps(now)}/{clock.fps:.1f} 丢帧: {self.dropped_frames}")
+
+        next_index = self.next_item['index'] if self.next_item is not None else self.current_frame + step
+        return max(1, min(self.delay, int(clock.time_until(next_index, now) * 1000)))
+
+    def sync_playback(self):
+        """使后台解码线程的播放状态与界面一致（暂停/继续/倍速/切换视频）"""
+        video_path = self.video_list[self.video_index]
+        step = self.allowed_speed[self.speed_index]
+        prefetcher = self.prefetcher
+        if self.paused:
+            if prefetcher.playing:
+                prefetcher.request(video_path, self.current_frame, step, playing=False)
+        elif not prefetcher.playing or prefetcher.step != step or prefetcher.video_path != video_path:
+            start = self.current_frame
+            if self.displayed_frame == (video_path, self.current_frame):
+                start += step
+            prefetcher.request(video_path, start, step, playing=True)
+            self.next_item = None
+            self.dropped_frames = 0
+            self.playback_clock.reset(start, self.video_fps, step)
 
     def load_records(self):
         """从当前视频文件对应的标注txt中加载标注记录"""
@@ -759,24 +3136,31 @@ class BehaviLabel:
         self.annotation_listbox.delete(0, tk.END)
         self.annotation_records[video_name] = []
 
-        # 检查标注文件是否存在
+        # 检查标注文件是否存在，优先使用后台预读的结果
         if os.path.exists(record_file):
             try:
-                with open(record_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line:
-                            # 解析标注记录 (格式: 起始帧 结束帧 行为)
-                            parts = line.split()
-                            if len(parts) >= 3:
-                                start_frame = parts[0]
-                                end_frame = parts[1]
-                                behavior = ' '.join(parts[2:])  # 处理行为名称中可能包含空格的情况
-                                record_str = f"{start_frame}-{end_frame}: {behavior}"
-                                self.annotation_records[video_name].append(record_str)
-                                self.annotation_listbox.insert(tk.END, record_str)
+                records = self.preloader.get_records(record_file)
+                if records is None:
+                    records = read_annotation_records(record_file)
+                self.annotation_records[video_name] = records
+                self.annotation_listbox.insert(tk.END, *records)
             except Exception as e:
                 self.show_custom_message(f"加载标注记录失败: {str(e)}")
+        self.refresh_video_entry(self.video_index)
+        self.draw_label_timeline()
+
+    def refresh_video_entry(self, index):
+        """标注记录变化后更新视频列表中对应行的记录数"""
+        video_path = self.video_list[index]
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        count = len(self.annotation_records.get(video_name, []))
+        if count:
+            self.labeled_names.add(video_name)
+        else:
+            self.labeled_names.discard(video_name)
+        if self.catalog is not None and self.catalog.label_counts.get(video_path, 0) != count:
+            self.catalog.label_counts[video_path] = count
+            self.video_list_view.refresh()
 
     def change_speed(self):
         self.speed_index+=1
@@ -785,9 +3169,46 @@ class BehaviLabel:
         self.info("current speed:" + str(self.allowed_speed[self.speed_index]))
         self.btn_change_speed.config(text=str(self.allowed_speed[self.speed_index])+'倍速')
 
+    def toggle_use_proxy(self, event=None):
+        """切换代理播放模式，启用时在后台为所有视频生成代理"""
+        self.use_proxy = not self.use_proxy
+        self.use_proxy_var.set(self.use_proxy)
+        self.proxy_manager.enabled = self.use_proxy
+        if self.use_proxy:
+            self.request_proxies()
+        if self.video_list:
+            self.paused = True
+            self.show_frame(self.video_list[self.video_index])
+
+    def request_proxies(self):
+        """只为当前视频前后PROXY_WINDOW个视频生成代理，按距离由远到近排队，使当前视频最先生成；
+        窗口外的排队请求作废"""
+        if not self.video_list:
+            return
+        first = max(0, self.video_index - self.PROXY_WINDOW)
+        last = min(len(self.video_list), self.video_index + self.PROXY_WINDOW + 1)
+        order = sorted(range(first, last), key=lambda i: abs(i - self.video_index), reverse=True)
+        self.proxy_manager.retain([self.video_list[i] for i in order])
+        for i in order:
+            self.proxy_manager.request(self.video_list[i])
+
+    def change_frame_cache_size(self):
+        self.frame_cache_mb = self.frame_cache_mb_var.get()
+        self.frame_cache.set_budget(self.frame_cache_mb * 1024 * 1024)
+        self.info("frame cache budget:" + str(self.frame_cache_mb) + "MB")
+
+    def progress_event_frame(self, event):
+        """计算进度条上鼠标位置对应的帧数"""
+        width = self.progress.winfo_width()
+        new_frame = int(event.x / width * self.total_frames)
+        return max(0, min(new_frame, self.total_frames - 1))
+
     def on_progress_drag(self, event):
-        """拖动进度条时实时输出当前值（带防抖）"""
+        """拖动进度条时实时输出当前值；有缩略图时只显示预览，否则带防抖解码"""
         self.paused = True
+        if self.total_frames > 0 and self.show_thumbnail_preview(self.progress_event_frame(event)):
+            self.dragging = True
+            return
         if not hasattr(self, 'last_drag') or time.time() - self.last_drag > 0.1:  # 0.1秒防抖
             self.last_drag = time.time()
             # 计算点击位置对应的帧数
@@ -806,25 +3227,115 @@ class BehaviLabel:
                 self.show_frame(self.video_list[self.video_index])
                 self.frame_label.config(text=f"{self.current_frame}/{self.total_frames}")
 
-    def on_video_select(self, event):
-        selection = self.video_listbox.curselection()
-        if selection:
-            index = selection[0]
-            # 如果切换的是不同的视频才重置current_frame
-            if index != self.video_index:
-                self.current_frame = 0
-            filepath = self.video_list[index]  # 取完整路径
-            total = len(self.video_list)
-            abs_path = os.path.abspath(filepath)
-            self.filename_label.config(
-                text=f"{abs_path}（{index + 1}/{total}）"
-            )
-            self.video_index = index
-            self.root.focus_set()
-            self.paused = True
-            self.show_frame(self.video_list[self.video_index])
-            self.update_progress()
-            self.load_records()
+    def on_progress_release(self, event):
+        """松开进度条时解码精确的目标帧"""
+        if not self.dragging:
+            return
+        self.dragging = False
+        self.current_frame = self.progress_event_frame(event)
+        self.show_frame(self.video_list[self.video_index])
+        self.update_progress()
+
+    def show_thumbnail_preview(self, frame_index):
+        """用最近的缩略图放大显示预览，缩略图未就绪时返回False"""
+        if not self.video_list or self.current_photo is None:
+            return False
+        thumbnails = self.thumbnail_generator.get(self.video_list[self.video_index])
+        if thumbnails is None:
+            return False
+        indices, thumbs = thumbnails
+        nearest = int(np.abs(indices - frame_index).argmin())
+        width, height = self.current_photo.width(), self.current_photo.height()
+        preview = cv2.resize(thumbs[nearest], (width, height), interpolation=cv2.INTER_LINEAR)
+        self.current_photo.paste(Image.frombuffer('RGB', (width, height), preview, 'raw', 'BGR', 0, 1))
+        self.current_frame = frame_index
+        self.frame_label.config(text=f"{self.current_frame}/{self.total_frames}")
+        self.update_timeline_cursor()
+        return True
+
+    def update_filmstrip(self):
+        """当前视频的缩略图就绪后绘制胶片条，每个视频只绘制一次"""
+        video_path = self.video_list[self.video_index]
+        if self.filmstrip_video == video_path:
+            return
+        thumbnails = self.thumbnail_generator.get(video_path)
+        if thumbnails is None:
+            if self.filmstrip_requested != video_path:
+                # 切换视频后先清空胶片条，等待后台生成
+                self.filmstrip_requested = video_path
+                self.thumbnail_generator.request(video_path)
+                for item in self.filmstrip_items:
+                    self.filmstrip_canvas.itemconfig(item, image='')
+                self.filmstrip_photos = []
+            return
+        self.filmstrip_video = video_path
+        indices, thumbs = thumbnails
+        slot_width = self.display_width // self.filmstrip_count
+        self.filmstrip_photos = []
+        for item, i in zip(self.filmstrip_items,
+                           np.linspace(0, len(indices) - 1, self.filmstrip_count).astype(int)):
+            thumb = thumbs[i]
+            ratio = min((slot_width - 4) / thumb.shape[1], (self.filmstrip_height - 4) / thumb.shape[0])
+            size = (max(1, int(thumb.shape[1] * ratio)), max(1, int(thumb.shape[0] * ratio)))
+            thumb = cv2.resize(thumb, size, interpolation=cv2.INTER_AREA)
+            photo = ImageTk.PhotoImage(Image.frombuffer('RGB', size, thumb, 'raw', 'BGR', 0, 1))
+            self.filmstrip_photos.append(photo)
+            self.filmstrip_canvas.itemconfig(item, image=photo)
+        self.update_filmstrip_marker()
+
+    def update_filmstrip_marker(self):
+        """在胶片条上标记当前帧所在的缩略图"""
+        if self.filmstrip_video is None or self.total_frames <= 0 or \
+                self.filmstrip_video != self.video_list[self.video_index]:
+            self.filmstrip_canvas.itemconfig(self.filmstrip_marker, state=tk.HIDDEN)
+            return
+        slot_width = self.display_width // self.filmstrip_count
+        slot = min(self.filmstrip_count - 1, self.current_frame * self.filmstrip_count // self.total_frames)
+        self.filmstrip_canvas.coords(self.filmstrip_marker, slot * slot_width + 1, 1,
+                                     (slot + 1) * slot_width - 1, self.filmstrip_height - 1)
+        self.filmstrip_canvas.itemconfig(self.filmstrip_marker, state=tk.NORMAL)
+
+    def on_filmstrip_click(self, event):
+        """点击胶片条跳转到对应位置"""
+        if not self.video_list or self.total_frames <= 0:
+            return
+        self.paused = True
+        self.current_frame = min(self.total_frames - 1,
+                                 int(event.x / self.display_width * self.total_frames))
+        self.show_frame(self.video_list[self.video_index])
+        self.update_progress()
+
+    def on_video_select(self, index):
+        """在视频列表中点击视频"""
+        # 如果切换的是不同的视频才重置current_frame
+        if index != self.video_index:
+            self.current_frame = 0
+        self.video_index = index
+        self.root.focus_set()
+        self.paused = True
+        self.switch_video()
+
+    def switch_video(self):
+        """显示video_index对应的视频并同步列表选中状态"""
+        filepath = self.video_list[self.video_index]  # 取完整路径
+        total = len(self.video_list)
+        abs_path = os.path.abspath(filepath)
+        self.filename_label.config(
+            text=f"{abs_path}（{self.video_index + 1}/{total}）"
+        )
+        self.video_list_view.select(self.video_index)
+        self.show_frame(self.video_list[self.video_index])
+        self.update_progress()
+        self.load_records()
+
+    def neighbor_video_index(self, direction):
+        """筛选后列表中的上一个(-1)或下一个(1)视频索引，没有时返回None"""
+        rows = self.video_rows
+        if direction > 0:
+            row = bisect.bisect_right(rows, self.video_index)
+            return rows[row] if row < len(rows) else None
+        row = bisect.bisect_left(rows, self.video_index) - 1
+        return rows[row] if row >= 0 else None
 
     def confirm_annotation(self, event=None):
         """确认标注按钮的回调函数"""
@@ -839,42 +3350,9 @@ class BehaviLabel:
 
         # 如果有框选区域，获取坐标
         selection_coords = None
-        if self.selection_start and self.selection_end:
-            # 转换为视频原始坐标
-            display_width = self.video_canvas.winfo_width()
-            display_height = self.video_canvas.winfo_height()
-
-            # 计算缩放比例
-            ratio = min(display_width / self.video_width,
-                        display_height / self.video_height)
-            new_width = int(self.video_width * ratio)
-            new_height = int(self.video_height * ratio)
-
-            # 计算偏移量
-            x_offset = (display_width - new_width) // 2
-            y_offset = (display_height - new_height) // 2
-
-            # 转换坐标
-            x1 = max(0, min(self.selection_start[0], self.selection_end[0]))
-            y1 = max(0, min(self.selection_start[1], self.selection_end[1]))
-            x2 = min(new_width, max(self.selection_start[0], self.selection_end[0]))
-            y2 = min(new_height, max(self.selection_start[1], self.selection_end[1]))
-
-            # 转换为原始视频坐标
-            x1 = int((x1 - x_offset) / ratio)
-            y1 = int((y1 - y_offset) / ratio)
-            x2 = int((x2 - x_offset) / ratio)
-            y2 = int((y2 - y_offset) / ratio)
-
-            # 确保坐标在视频范围内
-            x1 = max(0, min(x1, self.video_width - 1))
-            y1 = max(0, min(y1, self.video_height - 1))
-            x2 = max(0, min(x2, self.video_width - 1))
-            y2 = max(0, min(y2, self.video_height - 1))
-
-            # 确保x2 > x1且y2 > y1
-            if x2 > x1 and y2 > y1:
-                selection_coords = f"{x1},{y1},{x2},{y2}"
+        coords = self.selection_to_video_coords()
+        if coords is not None:
+            selection_coords = "{},{},{},{}".format(*coords)
 
         # 确保保存目录已设置
         if not self.save_dir:
@@ -964,20 +3442,13 @@ class BehaviLabel:
         return "break"  # 阻止事件继续传播
 
     def next_video(self,event=None):
-        if self.video_index < len(self.video_list) - 1:
-            self.video_index += 1
-            filepath = self.video_list[self.video_index]  # 取完整路径
-            total = len(self.video_list)
-            abs_path = os.path.abspath(filepath)
-            self.filename_label.config(
-                text=f"{abs_path}（{self.video_index + 1}/{total}）"
-            )
+        index = self.neighbor_video_index(1)
+        if index is not None:
+            self.video_index = index
             self.current_frame = 0
             self.root.focus_set()
             self.paused = True
-            self.show_frame(self.video_list[self.video_index])
-            self.update_progress()
-            self.load_records()
+            self.switch_video()
             return True
         else:
             msg = f"已经是最后一个视频"
@@ -986,20 +3457,13 @@ class BehaviLabel:
             return False
 
     def last_video(self,event=None):
-        if self.video_index >= 1:
-            self.video_index -= 1
-            filepath = self.video_list[self.video_index]  # 取完整路径
-            total = len(self.video_list)
-            abs_path = os.path.abspath(filepath)
-            self.filename_label.config(
-                text=f"{abs_path}（{self.video_index + 1}/{total}）"
-            )
+        index = self.neighbor_video_index(-1)
+        if index is not None:
+            self.video_index = index
             self.current_frame = 0
             self.root.focus_set()
             self.paused = True
-            self.show_frame(self.video_list[self.video_index])
-            self.update_progress()
-            self.load_records()
+            self.switch_video()
         else:
             msg = f"已经是第一个视频"
             self.show_custom_message(msg)
@@ -1040,20 +3504,151 @@ class BehaviLabel:
             self.lb_label_list.config(text='标注记录')
 
     def load_video_directory(self):
-        """设置视频目录"""
+        """设置视频目录，后台递归扫描并逐批显示到列表中"""
         directory = filedialog.askdirectory()
         if directory:
+            if self.scan_cancel is not None:
+                self.scan_cancel.set()
             self.video_dir = directory
             self.video_list.clear()
-            self.video_listbox.delete(0, tk.END)
-            for filename in os.listdir(directory):
-                if filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
-                    path = os.path.join(directory, filename)
-                    self.video_list.append(path)
-                    self.video_listbox.insert(tk.END, filename)  # 只插入文件名
-            msg = f"找到 {len(self.video_list)} 个视频文件"
-            self.show_custom_message(msg)
-            self.lb_video_list.config(text="视频目录")
+            self.video_subfolders.clear()
+            self.subfolders = set()
+            self.video_names = set()
+            self.duplicate_videos = []
+            self.video_rows = []
+            self.video_index = 0
+            self.current_frame = 0
+            self.catalog = VideoCatalog(directory)
+            self.labeled_names = self.scan_labeled_names()
+            self.subfolder_var.set("全部")
+            self.subfolder_combobox['values'] = ["全部"]
+            self.video_list_view.set_rows(self.video_rows, self.format_video_entry)
+            self.lb_video_list.config(text="视频目录(扫描中)")
+
+            self.scan_cancel = threading.Event()
+            self.scan_batches = queue.Queue()
+            threading.Thread(target=scan_videos, args=(directory, self.scan_batches, self.scan_cancel),
+                             daemon=True).start()
+            self.poll_scan(self.scan_batches)
+
+    def poll_scan(self, batches):
+        """把扫描线程的结果逐批追加到视频列表"""
+        if batches is not self.scan_batches:
+            return
+        done = False
+        subfolder = self.subfolder_var.get()
+        unlabeled_only = self.unlabeled_only_var.get()
+        while True:
+            try:
+                batch = batches.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                done = True
+                break
+            for path in batch:
+                # 标注文件按文件名保存，同名视频会共用同一个标注文件，只保留扫描顺序中的第一个
+                video_name = os.path.splitext(os.path.basename(path))[0]
+                if video_name in self.video_names:
+                    self.duplicate_videos.append(path)
+                    continue
+                self.video_names.add(video_name)
+                relative_dir = os.path.relpath(os.path.dirname(path), self.video_dir)
+                self.subfolders.add(relative_dir)
+                self.video_list.append(path)
+                self.video_subfolders.append(relative_dir)
+                index = len(self.video_list) - 1
+                if self.video_matches_filter(index, subfolder, unlabeled_only):
+                    self.video_rows.append(index)
+        self.video_list_view.refresh()
+
+        if not done:
+            self.lb_video_list.config(text=f"视频目录(扫描中 {len(self.video_list)})")
+            self.root.after(100, self.poll_scan, batches)
+            return
+
+        self.scan_batches = None
+        self.subfolder_combobox['values'] = ["全部"] + sorted(self.subfolders)
+        if self.use_proxy:
+            self.request_proxies()
+        msg = f"找到 {len(self.video_list)} 个视频文件"
+        if self.duplicate_videos:
+            shown = [os.path.relpath(path, self.video_dir) for path in self.duplicate_videos[:10]]
+            msg += (f"\n以下{len(self.duplicate_videos)}个视频与已有视频同名(标注文件按文件名保存)，已忽略:\n"
+                    + "\n".join(shown) + ("\n..." if len(self.duplicate_videos) > 10 else ""))
+        self.show_custom_message(msg)
+        self.lb_video_list.config(text="视频目录")
+        self.start_catalog_probe()
+
+    def scan_labeled_names(self):
+        """保存目录中已有标注txt的视频名"""
+        if not self.save_dir or not os.path.isdir(self.save_dir):
+            return set()
+        return {os.path.splitext(f)[0] for f in os.listdir(self.save_dir) if f.endswith('.txt')}
+
+    def video_matches_filter(self, index, subfolder, unlabeled_only):
+        if subfolder != "全部" and self.video_subfolders[index] != subfolder:
+            return False
+        if unlabeled_only:
+            video_name = os.path.splitext(os.path.basename(self.video_list[index]))[0]
+            if video_name in self.labeled_names:
+                return False
+        return True
+
+    def apply_video_filter(self, event=None):
+        """按筛选条件重建列表行"""
+        self.root.focus_set()
+        if self.unlabeled_only_var.get():
+            self.labeled_names = self.scan_labeled_names()
+            if self.catalog is not None:
+                self.labeled_names -= {os.path.splitext(os.path.basename(path))[0]
+                                       for path, count in self.catalog.label_counts.items() if count == 0}
+        subfolder = self.subfolder_var.get()
+        unlabeled_only = self.unlabeled_only_var.get()
+        self.video_rows = [i for i in range(len(self.video_list))
+                           if self.video_matches_filter(i, subfolder, unlabeled_only)]
+        self.video_list_view.set_rows(self.video_rows)
+        if self.video_list:
+            self.video_list_view.see(self.video_index)
+
+    def start_catalog_probe(self):
+        """在后台线程池中探测视频元数据，完成后刷新列表"""
+        catalog = self.catalog
+        threading.Thread(target=catalog.probe_all, args=(list(self.video_list), self.save_dir),
+                         daemon=True).start()
+        self.poll_catalog(catalog)
+
+    def poll_catalog(self, catalog):
+        """轮询探测进度，只在Tk主线程中更新界面"""
+        if catalog is not self.catalog:
+            return
+        if not catalog.done:
+            self.lb_video_list.config(text=f"视频目录(探测中 {catalog.probed}/{catalog.total})")
+            self.root.after(200, self.poll_catalog, catalog)
+            return
+        self.lb_video_list.config(text="视频目录")
+        self.video_list_view.refresh()
+
+    def catalog_for(self, video_dir):
+        """导出等工具使用的目录与当前视频目录相同时，复用已探测的元数据"""
+        if self.catalog is None or not video_dir:
+            return None
+        if os.path.abspath(self.catalog.video_dir) != os.path.abspath(video_dir):
+            return None
+        return self.catalog
+
+    def format_video_entry(self, index):
+        """视频列表中的一行：文件名、时长和标注记录数"""
+        video_path = self.video_list[index]
+        text = os.path.basename(video_path)
+        entry = self.catalog.get(video_path) if self.catalog is not None else None
+        if entry is not None and entry["fps"] > 0:
+            duration = entry['frames'] / entry['fps']
+            text += f"  [{time.strftime('%H:%M:%S' if duration >= 3600 else '%M:%S', time.gmtime(duration))}]"
+        count = self.catalog.label_counts.get(video_path) if self.catalog is not None else None
+        if count:
+            text += f"  ({count}条)"
+        return text
 
     def show_custom_message(self, message, links=None):
         """显示自定义消息框，支持超链接和文本复制"""
@@ -1116,93 +3711,180 @@ class BehaviLabel:
         top.geometry(f'+{x}+{y}')
 
     def show_frame(self, video_path):
+        """请求后台线程解码current_frame，实际显示在update中完成"""
         self.debug(self.current_frame)
-        # 释放之前的资源
-        if self.cap is not None:
-            self.cap.release()
-
-        # 清除画布上的内容
-        self.video_canvas.delete("all")
-
-        self.cap = cv2.VideoCapture(video_path)
-        if not self.cap.isOpened():
+        if self.displayed_frame is None or self.displayed_frame[0] != video_path:
+            if self.use_proxy:
+                self.request_proxies()  # 切换视频时代理窗口随之移动，当前视频优先
+            self.preload_neighbors()
+            # 首帧解码前先用目录缓存的元数据更新进度条
+            entry = self.catalog.get(video_path) if self.catalog is not None else None
+            if entry is not None:
+                self.video_width = entry["width"]
+                self.video_height = entry["height"]
+                self.video_fps = entry["fps"]
+                self.total_frames = entry["frames"]
+        self.prefetcher.request(video_path, self.current_frame,
+                                self.allowed_speed[self.speed_index], playing=not self.paused)
+
+    def preload_neighbors(self):
+        """后台预热下一个和上一个视频，使A/D切换和连续播放无停顿"""
+        jobs = []
+        for index in [self.neighbor_video_index(1), self.neighbor_video_index(-1)]:
+            if index is not None:
+                video_path = self.video_list[index]
+                record_file = None
+                if self.save_dir:
+                    video_name = os.path.splitext(os.path.basename(video_path))[0]
+                    record_file = os.path.join(self.save_dir, f"{video_name}.txt")
+                jobs.append((video_path, record_file))
+        self.preloader.preload(jobs)
+
+    def process_frame(self, frame):
+        """在后台解码线程中缩放帧，返回可直接显示的图像；骨骼推理由SkeletonWorker单独完成"""
+        # 按保持比例的缩放因子缩放到预分配缓冲区，颜色通道交换留到显示时一并完成
+        return self.frame_scaler.scale(frame)
+
+    def request_skeleton(self):
+        """把当前显示帧提交给骨骼推理线程，只有模型已加载才进行处理"""
+        # 需要绘制骨骼但模型未加载时，先加载模型，显示原始帧等待
+        if self.draw_skeleton and self.ort_session is None and not self.model_loading \
+                and not self.model_load_failed:
+            self.load_model_async()
+            return
+        if self.draw_skeleton and self.model_loaded and self.ort_session is not None \
+                and self.displayed_source is not None:
+            # ROI跟踪时以框选区域作为初始区域
+            roi_hint = self.selection_to_video_coords() if self.skeleton_worker.tracking else None
+            self.skeleton_worker.submit(self.ort_session, self.displayed_frame, self.displayed_source,
+                                        self.conf_threshold, self.model_hash, self.video_width, roi_hint)
+
+    def toggle_skeleton_tracking(self, event=None):
+        """切换骨骼ROI跟踪推理"""
+        self.skeleton_worker.tracking = not self.skeleton_worker.tracking
+        self.skeleton_tracking_var.set(self.skeleton_worker.tracking)
+
+    def display_frame(self, item):
+        """在Tk主线程中显示后台线程处理好的帧"""
+        self.video_width = item['width']
+        self.video_height = item['height']
+        self.total_frames = item['total_frames']
+        self.video_fps = item['fps']
+
+        if item['image'] is None:
+            # 播放到视频末尾
+            if item['playing']:
+                self.on_playback_end()
             return
 
-        # 获取视频原始尺寸
-        self.video_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.video_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame)
-        ret, frame = self.cap.read()
-
-        if ret:
-            # 如果需要绘制骨骼关键点
-            if getattr(self, 'draw_skeleton', False):
-                # 检查模型状态
-                if not hasattr(self, 'ort_session'):
-                    self.load_model_async()
-                    # 显示原始帧，等待模型加载
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    return
-
-                # 只有模型已加载才进行处理
-                if self.model_loaded and hasattr(self, 'ort_session'):
-                    try:
-                        frame, _ = show_skeleton_frame(self.ort_session, frame.copy(), self.conf_threshold)
-                    except Exception as e:
-                        print(f"骨骼检测处理出错: {e}")
-
-            # 转换和显示帧
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame)
-
-            # 计算保持比例的缩放因子
-            ratio = min(self.display_width / self.video_width,
-                        self.display_height / self.video_height)
-            new_width = int(self.video_width * ratio)
-            new_height = int(self.video_height * ratio)
-
-            # 调整图像大小
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-
-            # 计算居中位置
-            x_offset = (self.display_width - new_width) // 2
-            y_offset = (self.display_height - new_height) // 2
-
-            # 创建并显示图像
-            self.current_photo = ImageTk.PhotoImage(image=img)
-            self.video_canvas.create_image(x_offset, y_offset,
-                                           anchor=tk.NW,
-                                           image=self.current_photo)
-
-            # 如果有选择区域，重新绘制选择框
-            if self.enable_selection and self.selection_start and self.selection_end:
-                self.draw_selection_rect()
+        self.current_frame = item['index']
+        self.displayed_frame = (item['video_path'], item['index'])
+        self.displayed_image = item['image']
+        self.displayed_source = item['frame']
+        self.request_skeleton()
+        self.composite_frame()
+
+        if self.timeline_total != self.total_frames:
+            self.draw_label_timeline()
+        self.update_timeline_cursor()
+        self.update_filmstrip_marker()
+        self.update_progress()
 
-        # 只有在播放状态下才前进到下一帧
-        if not self.paused:
-            self.current_frame += self.allowed_speed[self.speed_index]
+    def composite_frame(self):
+        """把最近的骨骼推理结果叠加到当前显示帧上并刷新画布，结果最多滞后一次推理"""
+        frame = self.displayed_image
+        if frame is None:
+            return
+        if self.draw_skeleton:
+            self.skeleton_result_id = self.skeleton_worker.result_id
+            result = self.skeleton_worker.latest()
+            # 只叠加同一视频的结果；关键点坐标按推理帧宽度换算到显示尺寸，使用代理时同样适用
+            if result is not None and result[1] is not None and result[0][0] == self.displayed_frame[0]:
+                ys, xs, colors = self.skeleton_overlay(result, frame.shape)
+                frame = frame.copy()
+                frame[ys, xs] = colors
+
+        # 计算居中位置
+        height, width = frame.shape[:2]
+        x_offset = (self.display_width - width) // 2
+        y_offset = (self.display_height - height) // 2
+
+        # 解包时直接完成BGR到RGB的转换，复用同一个PhotoImage
+        img = Image.frombuffer('RGB', (width, height), frame, 'raw', 'BGR', 0, 1)
+        if self.current_photo is None or \
+                (self.current_photo.width(), self.current_photo.height()) != (width, height):
+            self.current_photo = ImageTk.PhotoImage('RGB', (width, height))
+            self.video_canvas.itemconfig(self.image_item, image=self.current_photo)
+            self.video_canvas.coords(self.image_item, x_offset, y_offset)
+        self.current_photo.paste(img)
+        # 框选模式下保存的选择框随每一帧一起显示
+        if self.enable_selection:
+            self.draw_selection_rect()
 
-        # 确保current_frame不超过视频总帧数
-        if self.current_frame >= self.total_frames:
-            if self.auto_playing:  # 自动播放时
-                if self.next_video():
-                    self.current_frame = 0
-                    self.paused = False
-            else:
-                self.current_frame = self.total_frames - 1
+    def skeleton_overlay(self, result, shape):
+        """在显示分辨率的透明图层上绘制推理结果，缓存其非透明像素；播放时同一结果叠加到后续各帧只需一次赋值"""
+        cached = self.skeleton_layer
+        if cached is None or cached[0] is not result or cached[1] != shape:
+            layer = np.zeros(shape, dtype=np.uint8)
+            draw_skeleton_kpts(layer, result[1], shape[1] / result[2])
+            ys, xs = np.nonzero(layer.any(axis=2))
+            self.skeleton_layer = cached = (result, shape, (ys, xs, layer[ys, xs]))
+        return cached[2]
+
+    def on_playback_end(self):
+        """播放到视频末尾：连续播放时切换下一个视频，否则停在最后一帧"""
+        if self.auto_playing and self.next_video():
+            self.current_frame = 0
+            self.paused = False
+        else:
+            self.paused = True
 
     def draw_selection_rect(self):
-        """绘制选择框"""
-        if self.selection_rect:
-            self.video_canvas.delete(self.selection_rect)
-
+        """绘制选择框（只更新常驻矩形的坐标）"""
         if self.selection_start and self.selection_end:
-            self.selection_rect = self.video_canvas.create_rectangle(
-                self.selection_start[0], self.selection_start[1],
-                self.selection_end[0], self.selection_end[1],
-                outline='red', width=2, dash=(5, 5)
-            )
+            self.video_canvas.coords(self.selection_rect,
+                                     self.selection_start[0], self.selection_start[1],
+                                     self.selection_end[0], self.selection_end[1])
+            self.video_canvas.itemconfig(self.selection_rect, state=tk.NORMAL)
+        else:
+            self.video_canvas.itemconfig(self.selection_rect, state=tk.HIDDEN)
+
+    def toggle_timeline(self, event=None):
+        self.show_timeline = not self.show_timeline
+        self.show_timeline_var.set(self.show_timeline)
+        self.draw_label_timeline()
+        self.update_timeline_cursor()
+
+    def draw_label_timeline(self):
+        """重绘时间轴上的标注段，只在标注记录或视频切换时调用"""
+        self.video_canvas.delete("timeline_segment")
+        self.timeline_total = self.total_frames
+        state = tk.NORMAL if self.show_timeline and self.total_frames > 0 else tk.HIDDEN
+        self.video_canvas.itemconfig(self.timeline_bg, state=state)
+        if state == tk.HIDDEN or not self.video_list:
+            return
+
+        video_name = os.path.splitext(os.path.basename(self.video_list[self.video_index]))[0]
+        timeline_y = self.display_height - 6
+        for record in self.annotation_records.get(video_name, []):
+            try:
+                start_frame, end_frame = map(int, record.split(": ", 1)[0].split("-"))
+            except ValueError:
+                continue
+            x1 = start_frame / self.total_frames * self.display_width
+            x2 = max(x1 + 1, (end_frame + 1) / self.total_frames * self.display_width)
+            self.video_canvas.create_rectangle(x1, timeline_y, x2, self.display_height,
+                                               fill='orange', outline='', tags="timeline_segment")
+        self.video_canvas.tag_raise(self.timeline_cursor)
+
+    def update_timeline_cursor(self):
+        """移动时间轴上的当前位置标记"""
+        if not self.show_timeline or self.total_frames <= 0:
+            self.video_canvas.itemconfig(self.timeline_cursor, state=tk.HIDDEN)
+            return
+        x = self.current_frame / self.total_frames * self.display_width
+        self.video_canvas.coords(self.timeline_cursor, x, self.display_height - 8, x, self.display_height)
+        self.video_canvas.itemconfig(self.timeline_cursor, state=tk.NORMAL)
 
     def update_progress(self):
         """更新进度条和帧数显示"""
@@ -1390,6 +4072,21 @@ class BehaviLabel:
                     result_text.insert(tk.END,
                                        f"{action}: {stats['count']} 条, {stats['frames']} 帧\n")
 
+                # 视频目录已探测过时，补充视频总量和标注进度
+                if self.catalog is not None and self.video_list:
+                    entries = [self.catalog.get(path) for path in self.video_list]
+                    entries = [entry for entry in entries if entry is not None]
+                    video_frames = sum(entry["frames"] for entry in entries)
+                    video_seconds = sum(entry["frames"] / entry["fps"] for entry in entries if entry["fps"] > 0)
+                    labeled_names = {os.path.splitext(f)[0] for f in txt_files}
+                    labeled_videos = sum(1 for path in self.video_list
+                                         if os.path.splitext(os.path.basename(path))[0] in labeled_names)
+                    result_text.insert(tk.END, f"\n=== 视频目录 ===\n")
+                    result_text.insert(tk.END, f"已标注视频: {labeled_videos}/{len(self.video_list)}\n")
+                    result_text.insert(tk.END, f"视频总帧数: {video_frames}\n")
+                    result_text.insert(tk.END,
+                                       f"视频总时长: {time.strftime('%H:%M:%S', time.gmtime(video_seconds))}\n")
+
                 result_text.config(state=tk.DISABLED)
                 status_label.config(text="统计完成", fg="green")
 
@@ -1430,12 +4127,19 @@ class BehaviLabel:
             'video_dir': tk.StringVar(value=self.video_dir),
             'txt_dir': tk.StringVar(value=self.save_dir),
             'output_dir': tk.StringVar(),
-            'crop_mode': tk.BooleanVar(value=False)  # 默认不裁剪
+            'crop_mode': tk.BooleanVar(value=False),  # 默认不裁剪
+            'workers': tk.IntVar(value=max(1, min(4, (os.cpu_count() or 2) // 2))),
+            'array_mode': tk.BooleanVar(value=False),  # 默认导出mp4
+            'array_frames': tk.IntVar(value=16),
+            'array_width': tk.IntVar(value=224),
+            'array_height': tk.IntVar(value=224)
         }
 
         # 创建进度条变量
         progress_var = tk.DoubleVar()
         progress_var.set(0)
+        updates = queue.Queue()
+        cancel = threading.Event()
 
         # 创建主框架
         main_frame = tk.Frame(top, padx=10, pady=10)
@@ -1506,6 +4210,24 @@ class BehaviLabel:
         crop_yes.pack(side=tk.LEFT, padx=5)
         crop_no.pack(side=tk.LEFT)
 
+        # 输出格式：mp4文件或训练用的数组分片(固定帧数和尺寸)
+        format_frame = tk.Frame(main_frame)
+        format_frame.pack(fill=tk.X, pady=5)
+        tk.Label(format_frame, text="输出格式:").pack(side=tk.LEFT)
+        tk.Radiobutton(format_frame, text="MP4", variable=selected_paths['array_mode'], value=False).pack(side=tk.LEFT, padx=5)
+        tk.Radiobutton(format_frame, text="数组分片", variable=selected_paths['array_mode'], value=True).pack(side=tk.LEFT)
+        for text, key, upper in (("帧数:", 'array_frames', 256), ("宽:", 'array_width', 4096),
+                                 ("高:", 'array_height', 4096)):
+            tk.Label(format_frame, text=text).pack(side=tk.LEFT, padx=(5, 0))
+            tk.Spinbox(format_frame, from_=1, to=upper, textvariable=selected_paths[key], width=5).pack(side=tk.LEFT)
+
+        # 并行进程数，每个进程一次导出一个视频
+        workers_frame = tk.Frame(main_frame)
+        workers_frame.pack(fill=tk.X, pady=5)
+        tk.Label(workers_frame, text="并行进程:").pack(side=tk.LEFT)
+        tk.Spinbox(workers_frame, from_=1, to=os.cpu_count() or 8, textvariable=selected_paths['workers'],
+                   width=5).pack(side=tk.LEFT, padx=5)
+
         # 进度条
         progress_frame = tk.Frame(main_frame)
         progress_frame.pack(fill=tk.X, pady=10)
@@ -1516,6 +4238,45 @@ class BehaviLabel:
         # 状态标签
         status_label = tk.Label(main_frame, text="", fg="blue")
         status_label.pack()
+        workers_label = tk.Label(main_frame, text="", fg="gray")
+        workers_label.pack()
+
+        # 导出在后台线程中进行，主线程轮询进度
+        def poll():
+            if not top.winfo_exists():
+                return
+            finished = None
+            while True:
+                try:
+                    kind, value = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'progress':
+                    progress_var.set(value['done'] / value['total'] * 100 if value['total'] else 100)
+                    status_label.config(text=f"正在处理: {value['video']} ({value['done']}/{value['total']})  "
+                                             f"剩余约 {int(value['remaining'])} 秒")
+                    workers_label.config(text="  ".join(f"进程{n + 1}: {fps:.0f}帧/秒" for n, fps in
+                                                        enumerate(value['workers'].values())))
+                else:
+                    finished = (kind, value)
+            if finished is None:
+                top.after(200, poll)
+                return
+            # 处理完成后关闭进度窗口
+            top.grab_release()
+            top.destroy()
+            if finished[0] == 'error':
+                self.show_custom_message(f"处理出错: {finished[1]}")
+            else:
+                # 显示完成消息（会自动置顶）
+                msg = "视频分片完成！"
+                if finished[1]['up_to_date']:
+                    msg += f"{finished[1]['up_to_date']}条记录未变化，已跳过"
+                if finished[1]['skipped']:
+                    msg += f"\n{finished[1]['skipped']}条记录因找不到视频或格式无效未导出"
+                if finished[1]['duplicates']:
+                    msg += f"\n{len(finished[1]['duplicates'])}个视频与其他视频同名，已忽略"
+                self.show_custom_message(msg)
 
         # 确认按钮
         def start_processing():
@@ -1524,42 +4285,34 @@ class BehaviLabel:
                 self.show_custom_message("请选择输出目录")
                 return
 
-            # 获取用户选择的裁剪模式
-            crop_selected = selected_paths['crop_mode'].get()
-
             # 禁用按钮
             confirm_btn.config(state=tk.DISABLED)
+            status_label.config(text="正在读取标记...")
+            video_dir = selected_paths['video_dir'].get()
+            args = (video_dir, selected_paths['txt_dir'].get(), selected_paths['output_dir'].get(),
+                    selected_paths['crop_mode'].get(), self.catalog_for(video_dir), selected_paths['workers'].get())
+            array_shape = None
+            if selected_paths['array_mode'].get():
+                array_shape = (selected_paths['array_frames'].get(), selected_paths['array_width'].get(),
+                               selected_paths['array_height'].get())
+
+            def task():
+                try:
+                    status = export_cropped_video(*args, progress=lambda status: updates.put(('progress', dict(status))),
+                                                  cancel=cancel, array_shape=array_shape)
+                    updates.put(('done', status))
+                except Exception as e:
+                    updates.put(('error', str(e)))
 
-            # 开始处理
-            try:
-                success = export_cropped_video(
-                    video_dir=selected_paths['video_dir'].get(),
-                    txt_dir=selected_paths['txt_dir'].get(),
-                    output_dir=selected_paths['output_dir'].get(),
-                    progress_var=progress_var,
-                    status_label=status_label,
-                    top_window=top,
-                    crop=crop_selected  # 将裁剪模式传递给处理函数
-                )
-
-                # 处理完成后关闭进度窗口
-                top.grab_release()
-                top.destroy()
-
-                # 显示完成消息（会自动置顶）
-                self.show_custom_message("视频分片完成！")
-
-            except Exception as e:
-                # 出错时也关闭进度窗口
-                top.grab_release()
-                top.destroy()
-                self.show_custom_message(f"处理出错: {str(e)}")
+            threading.Thread(target=task, daemon=True).start()
+            poll()
 
         confirm_btn = tk.Button(main_frame, text="开始分片", command=start_processing)
         confirm_btn.pack(pady=10)
 
-        # 窗口关闭时的处理
+        # 关闭窗口即取消，未写完的片段会被删除
         def on_closing():
+            cancel.set()
             top.grab_release()
             top.destroy()
 
@@ -1573,13 +4326,139 @@ class BehaviLabel:
         y = (top.winfo_screenheight() // 2) - (height // 2)
         top.geometry(f'+{x}+{y}')
 
+    def precompute_keypoints(self):
+        """批量计算关键点窗口：进程池在后台运行，主线程轮询进度"""
+        top = tk.Toplevel(self.root)
+        top.title("批量计算关键点")
+        top.resizable(False, False)
+        top.attributes('-topmost', True)
+        top.grab_set()
+
+        settings = {
+            'video_dir': tk.StringVar(value=self.video_dir),
+            'model_path': tk.StringVar(value=self.model_path),
+            'output_dir': tk.StringVar(),
+            'stride': tk.IntVar(value=1),
+            'workers': tk.IntVar(value=max(1, (os.cpu_count() or 2) // 4)),
+            'threads': tk.IntVar(value=2),
+        }
+        progress_var = tk.DoubleVar(value=0)
+        updates = queue.Queue()
+        cancel = threading.Event()
+
+        main_frame = tk.Frame(top, padx=10, pady=10)
+        main_frame.pack()
+
+        def browse(key, title, is_file=False):
+            top.attributes('-topmost', False)
+            if is_file:
+                path = filedialog.askopenfilename(title=title, filetypes=[("ONNX模型文件", "*.onnx")], parent=top)
+            else:
+                path = filedialog.askdirectory(title=title, initialdir=settings[key].get() or None, parent=top)
+            top.attributes('-topmost', True)
+            if path:
+                settings[key].set(path)
+
+        for key, text, is_file in [('video_dir', "视频目录:", False), ('model_path', "模型文件:", True),
+                                   ('output_dir', "输出目录:", False)]:
+            row = tk.Frame(main_frame)
+            row.pack(fill=tk.X, pady=5)
+            tk.Label(row, text=text).pack(side=tk.LEFT)
+            tk.Entry(row, textvariable=settings[key], width=40).pack(side=tk.LEFT, padx=5)
+            tk.Button(row, text="浏览...", command=lambda k=key, t=text, f=is_file: browse(k, t.rstrip(":"), f)
+                      ).pack(side=tk.LEFT)
+
+        option_frame = tk.Frame(main_frame)
+        option_frame.pack(fill=tk.X, pady=5)
+        for key, text, upper in [('stride', "每隔帧数:", 1000), ('workers', "进程数:", os.cpu_count() or 4),
+                                 ('threads', "每进程线程数:", 16)]:
+            tk.Label(option_frame, text=text).pack(side=tk.LEFT)
+            tk.Spinbox(option_frame, from_=1, to=upper, textvariable=settings[key], width=5).pack(side=tk.LEFT, padx=5)
+
+        progress_frame = tk.Frame(main_frame)
+        progress_frame.pack(fill=tk.X, pady=10)
+        tk.Label(progress_frame, text="进度:").pack(side=tk.LEFT)
+        ttk.Progressbar(progress_frame, variable=progress_var, maximum=100).pack(
+            side=tk.LEFT, expand=True, fill=tk.X, padx=5)
+        status_label = tk.Label(main_frame, text="已完成的视频会自动跳过", fg="blue")
+        status_label.pack()
+
+        def poll():
+            if not top.winfo_exists():
+                return
+            finished = None
+            while True:
+                try:
+                    kind, value = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'progress':
+                    processed, total, frame_count, fps = value
+                    progress_var.set(processed / total * 100 if total else 100)
+                    status_label.config(text=f"视频 {processed}/{total}  已推理 {frame_count} 帧  {fps:.1f} 帧/秒")
+                else:
+                    finished = (kind, value)
+            if finished is None:
+                top.after(200, poll)
+                return
+            top.grab_release()
+            top.destroy()
+            if finished[0] == 'error':
+                self.show_custom_message(f"处理出错: {finished[1]}")
+            else:
+                done, skipped, failed, fps = finished[1]
+                self.show_custom_message(f"关键点计算完成：新完成{done}个，跳过{skipped}个，失败{failed}个，"
+                                         f"平均{fps:.1f}帧/秒")
+
+        def start():
+            if not settings['video_dir'].get() or not settings['model_path'].get() \
+                    or not settings['output_dir'].get():
+                self.show_custom_message("请选择视频目录、模型文件和输出目录")
+                return
+            confirm_btn.config(state=tk.DISABLED)
+            args = (settings['video_dir'].get(), settings['model_path'].get(), settings['output_dir'].get(),
+                    settings['stride'].get(), settings['workers'].get(), settings['threads'].get())
+
+            def task():
+                try:
+                    result = precompute_keypoints(*args, batch_size=self.inference_batch_size,
+                                                  session_settings=self.session_settings,
+                                                  progress=lambda *p: updates.put(('progress', p)),
+                                                  cancel=cancel)
+                    updates.put(('done', result))
+                except Exception as e:
+                    updates.put(('error', str(e)))
+
+            threading.Thread(target=task, daemon=True).start()
+            poll()
+
+        confirm_btn = tk.Button(main_frame, text="开始计算", command=start)
+        confirm_btn.pack(pady=10)
+
+        # 关闭窗口即取消，正在处理的视频完成后停止
+        def on_closing():
+            cancel.set()
+            top.grab_release()
+            top.destroy()
+
+        top.protocol("WM_DELETE_WINDOW", on_closing)
+
+        top.update_idletasks()
+        width = top.winfo_width()
+        height = top.winfo_height()
+        x = (top.winfo_screenwidth() // 2) - (width // 2)
+        y = (top.winfo_screenheight() // 2) - (height // 2)
+        top.geometry(f'+{x}+{y}')
+
     def toggle_draw_skeleton(self,event=None):
         if self.model_loaded:
             self.draw_skeleton = not self.draw_skeleton
             if self.draw_skeleton:
                 self.lb_draw_skeleton.config(text="骨骼绘制已启用")
+                self.request_skeleton()
             else:
                 self.lb_draw_skeleton.config(text="骨骼绘制未启用")
+            self.composite_frame()
         else:
             self.paused = True
             self.show_custom_message("模型未加载")
@@ -1602,9 +4481,15 @@ class BehaviLabel:
             filetypes=[("ONNX模型文件", "*.onnx")]
         )
         if not model_path:
+            # 未选择模型时关闭骨骼绘制，避免每帧重复弹出选择框
+            self.draw_skeleton = False
+            self.lb_draw_skeleton.config(text="骨骼绘制未启用")
             self.show_custom_message("未选择模型文件")
             return
+        self.start_model_load(model_path)
 
+    def start_model_load(self, model_path):
+        """按当前推理设置在后台线程创建模型会话"""
         self.model_loading = True
         self.model_loaded = False
         self.model_load_failed = False
@@ -1614,8 +4499,15 @@ class BehaviLabel:
         # 在后台线程加载模型
         def load_task():
             try:
-                self.ort_session = initialize_session(model_path)
+                session = initialize_session(model_path, **self.session_settings)
+                if session is not None:
+                    # 预热完成后才报告模型就绪，避免开启骨骼绘制时首几帧卡顿
+                    session = SkeletonSession(session)
+                    session.warmup()
+                self.ort_session = session
                 if self.ort_session is not None:
+                    self.model_path = model_path
+                    self.model_hash = model_file_hash(model_path)
                     self.model_loaded = True
                     self.model_load_failed = False
                     print("模型加载完成")
@@ -1632,6 +4524,195 @@ class BehaviLabel:
 
         threading.Thread(target=load_task, daemon=True).start()
 
+    def inference_settings(self):
+        """推理设置窗口：会话线程、执行模式、优化级别和batch大小，以及本机测速"""
+        top = tk.Toplevel(self.root)
+        top.title("推理设置")
+        top.resizable(False, False)
+        top.attributes('-topmost', True)
+
+        variables = {
+            'intra_threads': tk.IntVar(value=self.session_settings['intra_threads']),
+            'inter_threads': tk.IntVar(value=self.session_settings['inter_threads']),
+            'parallel': tk.BooleanVar(value=self.session_settings['parallel']),
+            'optimization_level': tk.StringVar(value=self.session_settings['optimization_level']),
+            'batch_size': tk.IntVar(value=self.inference_batch_size),
+        }
+        updates = queue.Queue()
+        cancel = threading.Event()
+
+        main_frame = tk.Frame(top, padx=10, pady=10)
+        main_frame.pack()
+        cpus = os.cpu_count() or 4
+        for key, text, upper in [('intra_threads', "算子内线程数(0为自动):", cpus),
+                                 ('inter_threads', "算子间线程数(0为自动):", cpus),
+                                 ('batch_size', "批量计算的batch大小:", 64)]:
+            row = tk.Frame(main_frame)
+            row.pack(fill=tk.X, pady=3)
+            tk.Label(row, text=text).pack(side=tk.LEFT)
+            tk.Spinbox(row, from_=0 if key != 'batch_size' else 1, to=upper, textvariable=variables[key],
+                       width=5).pack(side=tk.RIGHT)
+        row = tk.Frame(main_frame)
+        row.pack(fill=tk.X, pady=3)
+        tk.Label(row, text="图优化级别:").pack(side=tk.LEFT)
+        ttk.Combobox(row, textvariable=variables['optimization_level'], state="readonly", width=10,
+                     values=list(SESSION_OPTIMIZATION_LEVELS)).pack(side=tk.RIGHT)
+        tk.Checkbutton(main_frame, text="算子间并行执行", variable=variables['parallel']).pack(anchor=tk.W)
+
+        result_text = tk.Text(main_frame, width=70, height=10, font=("Arial", 9))
+        result_text.pack(pady=5)
+
+        def apply():
+            self.session_settings = {key: variables[key].get() for key in self.session_settings}
+            self.inference_batch_size = max(1, variables['batch_size'].get())
+            # 已加载的模型按新设置重建会话
+            if self.model_loaded and self.model_path and not self.model_loading:
+                self.model_loaded = False
+                self.start_model_load(self.model_path)
+            on_closing()
+
+        def poll():
+            if not top.winfo_exists():
+                return
+            while True:
+                try:
+                    item = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    benchmark_btn.config(state=tk.NORMAL)
+                    result_text.insert(tk.END, "测速完成\n")
+                    return
+                config, fps = item
+                result_text.insert(tk.END, f"{fps:7.1f} 帧/秒  {format_session_config(config)}\n")
+                result_text.see(tk.END)
+            top.after(200, poll)
+
+        def benchmark():
+            model_path = self.model_path
+            if not model_path:
+                top.attributes('-topmost', False)
+                model_path = filedialog.askopenfilename(title="选择ONNX模型文件",
+                                                        filetypes=[("ONNX模型文件", "*.onnx")], parent=top)
+                top.attributes('-topmost', True)
+                if not model_path:
+                    return
+            benchmark_btn.config(state=tk.DISABLED)
+            result_text.delete("1.0", tk.END)
+            result_text.insert(tk.END, "测速中，每组配置推理32帧...\n")
+
+            def task():
+                try:
+                    session = initialize_session(model_path)
+                    configs = session_config_grid(session is not None and model_batch_size(session) is None)
+                    benchmark_session_configs(model_path, configs, report=lambda *r: updates.put(r), cancel=cancel)
+                except Exception as e:
+                    print(f"测速出错: {e}")
+                updates.put(None)
+
+            threading.Thread(target=task, daemon=True).start()
+            poll()
+
+        button_frame = tk.Frame(main_frame)
+        button_frame.pack(pady=5)
+        benchmark_btn = tk.Button(button_frame, text="本机测速", command=benchmark)
+        benchmark_btn.pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="应用", command=apply).pack(side=tk.LEFT, padx=5)
+
+        def on_closing():
+            cancel.set()
+            top.destroy()
+
+        top.protocol("WM_DELETE_WINDOW", on_closing)
+
+        top.update_idletasks()
+        width = top.winfo_width()
+        height = top.winfo_height()
+        x = (top.winfo_screenwidth() // 2) - (width // 2)
+        y = (top.winfo_screenheight() // 2) - (height // 2)
+        top.geometry(f'+{x}+{y}')
+
+    def quantize_model(self):
+        """用当前视频目录的采样帧校准，生成INT8量化模型并与FP32模型对比精度和速度"""
+        if not self.model_loaded or not self.model_path:
+            self.show_custom_message("请先加载骨骼模型")
+            return
+        if not self.video_list:
+            self.show_custom_message("请先加载视频目录")
+            return
+        model_path = self.model_path
+        output_path = os.path.splitext(model_path)[0] + "_int8.onnx"
+        video_paths = list(self.video_list)
+        session_settings = dict(self.session_settings)
+        catalog = self.catalog
+
+        top = tk.Toplevel(self.root)
+        top.title("INT8量化")
+        top.resizable(False, False)
+        top.attributes('-topmost', True)
+        main_frame = tk.Frame(top, padx=10, pady=10)
+        main_frame.pack()
+        status_label = tk.Label(main_frame, text="正在准备校准数据...", fg="blue")
+        status_label.pack()
+        report_text = tk.Text(main_frame, width=60, height=8, font=("Arial", 10))
+        report_text.pack(pady=5)
+        updates = queue.Queue()
+
+        def load_quantized():
+            top.destroy()
+            self.model_loaded = False
+            self.start_model_load(output_path)
+
+        load_btn = tk.Button(main_frame, text="加载INT8模型", command=load_quantized, state=tk.DISABLED)
+        load_btn.pack(pady=5)
+
+        def task():
+            try:
+                quantize_pose_model(model_path, output_path, video_paths,
+                                    progress=lambda done, total: updates.put(('status', f"校准中 {done}/{total} 帧")),
+                                    catalog=catalog)
+                updates.put(('status', "正在对比FP32与INT8模型..."))
+                report = compare_pose_models(model_path, output_path, video_paths, session_settings=session_settings,
+                                             catalog=catalog)
+                updates.put(('done', report))
+            except Exception as e:
+                updates.put(('error', str(e)))
+
+        def poll():
+            if not top.winfo_exists():
+                return
+            while True:
+                try:
+                    kind, value = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'status':
+                    status_label.config(text=value)
+                elif kind == 'error':
+                    status_label.config(text=f"量化失败: {value}", fg="red")
+                    return
+                else:
+                    status_label.config(text=f"已生成 {os.path.basename(output_path)}")
+                    report_text.insert(tk.END, format_model_comparison(value))
+                    load_btn.config(state=tk.NORMAL)
+                    return
+            top.after(200, poll)
+
+        threading.Thread(target=task, daemon=True).start()
+        poll()
+
+        top.update_idletasks()
+        width = top.winfo_width()
+        height = top.winfo_height()
+        x = (top.winfo_screenwidth() // 2) - (width // 2)
+        y = (top.winfo_screenheight() // 2) - (height // 2)
+        top.geometry(f'+{x}+{y}')
+
+    def on_close(self):
+        """退出前把未写盘的关键点缓存保存下来"""
+        self.keypoint_cache.flush()
+        self.root.destroy()
+
     def toggle_auto_playing(self,event=None):
         self.auto_playing = not self.auto_playing
         self.auto_playing_var.set(self.auto_playing)
@@ -1645,6 +4726,48 @@ class BehaviLabel:
             print(string)
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = BehaviLabel(root, 'debug')
-    root.mainloop()
\ No newline at end of file
+    multiprocessing.freeze_support()  # 打包的exe中工作进程从这里进入，而不是重新启动界面
+    parser = argparse.ArgumentParser(description="BehaviLabel 行为标注工具")
+    parser.add_argument("--precompute-keypoints", metavar="VIDEO_DIR", help="不启动界面，批量计算目录下视频的骨骼关键点")
+    parser.add_argument("--model", help="ONNX骨骼模型文件")
+    parser.add_argument("--output", help="关键点输出目录；与--quantize一起使用时为量化模型的输出路径")
+    parser.add_argument("--stride", type=int, default=1, help="每隔多少帧推理一次")
+    parser.add_argument("--workers", type=int, default=2, help="工作进程数")
+    parser.add_argument("--threads", type=int, default=2, help="每个进程的推理线程数")
+    parser.add_argument("--batch-size", type=int, default=8, help="每次推理的帧数(模型需支持动态batch)")
+    parser.add_argument("--benchmark", metavar="MODEL", help="不启动界面，测量不同推理设置在本机的帧率")
+    parser.add_argument("--quantize", metavar="MODEL", help="不启动界面，生成INT8量化模型并与原模型对比")
+    parser.add_argument("--calibration-dir", help="量化校准用的视频目录")
+    parser.add_argument("--calibration-frames", type=int, default=64, help="量化校准帧数")
+    args = parser.parse_args()
+
+    if args.precompute_keypoints:
+        if not args.model or not args.output:
+            parser.error("--precompute-keypoints 需要同时指定 --model 和 --output")
+
+        def report(processed, total, frame_count, fps):
+            print(f"视频 {processed}/{total}  已推理 {frame_count} 帧  {fps:.1f} 帧/秒", flush=True)
+
+        done, skipped, failed, fps = precompute_keypoints(
+            args.precompute_keypoints, args.model, args.output, stride=args.stride,
+            workers=args.workers, threads_per_worker=args.threads, batch_size=args.batch_size, progress=report)
+        print(f"完成{done}个，跳过{skipped}个，失败{failed}个，平均{fps:.1f}帧/秒")
+    elif args.quantize:
+        if not args.calibration_dir:
+            parser.error("--quantize 需要同时指定 --calibration-dir")
+        output_path = args.output or os.path.splitext(args.quantize)[0] + "_int8.onnx"
+        video_paths = list_videos(args.calibration_dir)
+        quantize_pose_model(args.quantize, output_path, video_paths, args.calibration_frames)
+        print(f"已生成 {output_path}")
+        print(format_model_comparison(compare_pose_models(args.quantize, output_path, video_paths)))
+    elif args.benchmark:
+        session = initialize_session(args.benchmark)
+        if session is None:
+            parser.exit(1)
+        benchmark_session_configs(args.benchmark, session_config_grid(model_batch_size(session) is None),
+                                  report=lambda config, fps: print(f"{fps:7.1f} 帧/秒  {format_session_config(config)}",
+                                                                   flush=True))
+    else:
+        root = tk.Tk()
+        app = BehaviLabel(root, 'debug')
+        root.mainloop()
\ No newline at end of file